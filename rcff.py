@@ -1,18 +1,25 @@
-import midi
 import os
-import pickle
-import array
+import sys
+import numpy as np
+from mido import MidiFile, MidiTrack, Message, MetaMessage
+
+OUTPUT_RESOLUTION = 480
 
 class RCFF(object):
-    
+
     instrument = -1
-    pitches = []
+    pitches = np.zeros(0, dtype=np.uint8)
     midi_file_path = ''
+    track_num = 0
 
-    def __init__(self, pitches, instrument=-1, midi_file_path=''):
-        self.pitches = pitches
+    def __init__(self, pitches, instrument=-1, midi_file_path='', track_num=0):
+        self.pitches = pitches # one pitch per quantum, 0 for rests
         self.instrument = instrument
         self.midi_file_path = midi_file_path
+        self.track_num = track_num
+
+    def to_bytes(self):
+        return self.pitches.tobytes()
 
 def midi_files_iter(folder_path):
     for root, dirs, files in os.walk(folder_path):
@@ -20,123 +27,99 @@ def midi_files_iter(folder_path):
             if file.endswith(".mid") or file.endswith(".MID"):
                  yield (os.path.join(root, file))
 
+def quantum_ticks(resolution):
+    # sixth of a beat
+    return (resolution + 3) // 6
+
 def extract_notes(track):
-    notes = [] # [(time, length, pitch)]
+    notes = [] # [(time, length, pitch)], time being the note's start
     time = 0
     pitch_started = {}
     instrument = -1
     found_instrument = False
     for event in track:
         #print(event)
-        time += event.tick
-        if not found_instrument and (type(event) is midi.ProgramChangeEvent):
+        time += event.time
+        if not found_instrument and event.type == 'program_change':
             found_instrument = True
-            if (event.data[0] >= 96):
+            if (event.program >= 96):
                 raise RuntimeError('atonal')
-            instrument = event.data[0]
-        if (type(event) is midi.NoteOnEvent):
-            pitch_started[event.pitch] = time
-        if (type(event) is midi.NoteOffEvent):
-            try:
-                start_time = pitch_started[event.pitch]
-                length = time - start_time
-                notes.append((time, length, event.pitch))
-            except KeyError:
-                pass
+            instrument = event.program
+        if event.type == 'note_on' and event.velocity > 0:
+            pitch_started[event.note] = time
+        elif event.type == 'note_off' or event.type == 'note_on':
+            start_time = pitch_started.pop(event.note, None)
+            if start_time is not None:
+                notes.append((start_time, time - start_time, event.note))
+    # notes are recorded as they end - order them by start
+    notes.sort()
     return notes, instrument
 
 def notes_to_time_series(notes, quantum):
-    quantum_series = []
-    series_end_quantum = 0
-    for note in notes:
-        time, length, pitch = note
-        time_quantum = (time + quantum // 2) // quantum
-        length_quantum = (length + quantum // 2) // quantum
-        if (time_quantum < series_end_quantum):
-            raise RuntimeError("overlap")
-        for i in xrange(time_quantum - series_end_quantum):
-            quantum_series.append(0)
-            series_end_quantum += 1
-        for i in xrange(length_quantum):
-            quantum_series.append(pitch)
-            series_end_quantum += 1
-    return quantum_series
-
-outputs = []
-
-for midi_file_path in midi_files_iter('.'):
-    pattern = midi.read_midifile(midi_file_path)
-    resolution = pattern.resolution
-    track_num = 0
-    for track in pattern:
-        track_num += 1
+    # (pitch, length) runs - a rest before every note - expanded with np.repeat
+    times, lengths, pitches = np.array(notes, dtype=np.int64).reshape(-1, 3).T
+    time_quanta = (times + quantum // 2) // quantum
+    length_quanta = (lengths + quantum // 2) // quantum
+    end_quanta = time_quanta + length_quanta
+
+    if np.any(time_quanta[1:] < end_quanta[:-1]):
+        raise RuntimeError("overlap")
+    rests = time_quanta - np.r_[0, end_quanta[:-1]]
+
+    values = np.c_[np.zeros_like(pitches), pitches].ravel()
+    counts = np.c_[rests, length_quanta].ravel()
+    return np.repeat(values, counts).astype(np.uint8)
+
+def time_series_to_track(pitches, quantum, instrument=0, velocity=64):
+    # one note per run of a pitch; rests are runs of 0
+    track = MidiTrack()
+    track.append(Message('program_change', program=max(instrument, 0), time=0))
+
+    starts = np.flatnonzero(np.r_[True, pitches[1:] != pitches[:-1]])
+    ends = np.r_[starts[1:], len(pitches)]
+    time = 0
+    for start, end in zip(starts, ends):
+        pitch = int(pitches[start])
+        if pitch == 0:
+            continue
+        track.append(Message('note_on', note=pitch, velocity=velocity, time=int(start * quantum - time)))
+        track.append(Message('note_off', note=pitch, velocity=0, time=int((end - start) * quantum)))
+        time = end * quantum
+    track.append(MetaMessage('end_of_track', time=0))
+    return track
+
+def extract_file(midi_file_path):
+    # monophonic series of every track of a midi file that has one
+    outputs = []
+    midi = MidiFile(midi_file_path)
+    quantum = quantum_ticks(midi.ticks_per_beat)
+    for track_num, track in enumerate(midi.tracks, 1):
         #print(track)
         try:
             notes, instrument = extract_notes(track)
             #print("START:")
             #print(notes)
             if (len(notes)):
-                quantum = (resolution + 3) // 6
                 pitches = notes_to_time_series(notes, quantum)
-                output = RCFF(pitches, instrument, midi_file_path)
-                outputs.append(output)
-                #pitches_bytes = array.array('B', pitches)
-                #with open(midi_file_path + '_track_' + str(track_num) + '.raw', 'wb') as pickle_file:
-                #    pickle_file.write(pitches_bytes)
+                outputs.append(RCFF(pitches, instrument, midi_file_path, track_num))
         except RuntimeError as e:
-            pass #print(e.message)
-    #exit(0)
-    #print pattern
-
-for composition in outputs:
-    # Instantiate a MIDI Pattern (contains a list of tracks)
-    pattern = midi.Pattern()
-    pattern.resolution = 480
-    
-    #track0 = midi.Track()
-    #track0.make_ticks_rel()
-    #pattern.append(track0)
-    ##event = midi.SmpteOffsetEvent(tick=0, data=[96, 0, 0, 0, 0])
-    ##track0.append(event)
-    #event = midi.TimeSignatureEvent(tick=0, data=[4, 2, 24, 8])
-    #track0.append(event)
-    #event = midi.SetTempoEvent(tick=0, data=[7, 129, 27, 143])
-    #track0.append(event)
-    #event = midi.EndOfTrackEvent()
-    #track0.append(event)
-    
-    
-    # Instantiate a MIDI Track (contains a list of MIDI events)
-    track = midi.Track()
-    track.make_ticks_rel()
-    # Append the track to the pattern
-    pattern.append(track)
-
-    if composition.instrument < 0:
-        composition.instrument = 0
-
-    #event = midi.ProgramChangeEvent(data=[composition.instrument])
-    #track.append(event)
-
-    #event = midi.ControlChangeEvent(control=7, value=100)
-    #track.append(event)
-
-    
-    #event = midi.ControlChangeEvent(control=10, value=90)
-    #track.append(event)
-
-    quantum = -1
-    for pitch in pitches:
-        quantum += 1
-        # Instantiate a MIDI note on event, append it to the track
-        on = midi.NoteOnEvent(tick=0, velocity=20, pitch=midi.C_3)
-        track.append(on)
-        # Instantiate a MIDI note off event, append it to the track
-        off = midi.NoteOffEvent(tick=100, pitch=midi.C_3)
-        track.append(off)
-    
-    # Add the end of track event, append it to the track
-    eot = midi.EndOfTrackEvent(tick=1)
-    track.append(eot)
-    # Save the pattern to disk
-    midi.write_midifile(composition.midi_file_path + '_track_' + str(track_num) + '.mid', pattern)
+            pass #print(e)
+    return outputs
+
+def write_midi(composition, filename):
+    midi = MidiFile(ticks_per_beat=OUTPUT_RESOLUTION)
+    midi.tracks.append(time_series_to_track(composition.pitches, quantum_ticks(OUTPUT_RESOLUTION), composition.instrument))
+    midi.save(filename)
+
+if __name__ == '__main__':
+    folder = sys.argv[1] if len(sys.argv) > 1 else '.'
+
+    outputs = []
+    for midi_file_path in midi_files_iter(folder):
+        outputs.extend(extract_file(midi_file_path))
+
+    for composition in outputs:
+        filename = composition.midi_file_path + '_track_' + str(composition.track_num)
+        #with open(filename + '.raw', 'wb') as raw_file:
+        #    raw_file.write(composition.to_bytes())
+        write_midi(composition, filename + '.mid')
@@ -1,6 +1,161 @@
+import os
 import pickle
 import numpy as np
 import struct
+import metrics
+from collections import OrderedDict
+
+# columnar tape files (.mtp):
+# a fixed little-endian header, then one column per event field, each padded to 8 bytes
+TAPE_MAGIC = b'MTAP'
+TAPE_VERSION = 2 # version 1 was a pickled MusicTape holding 5 packed bytes per event
+TAPE_HEADER = struct.Struct('<4sHHQqqqIH?HHQqq')
+TAPE_HEADER_SIZE = 128
+TAPE_COLUMNS = (
+	('time', np.dtype('<u4')),
+	('type', np.dtype('u1')),
+	('note', np.dtype('<u2')),
+	('velocity', np.dtype('<u2')),
+	)
+
+def load_tape(filename, offset = 0, mmap = True):
+	# read a tape file of any version - old pickled tapes are migrated on the fly
+	with open(filename, 'rb') as f:
+		f.seek(offset)
+		if f.read(len(TAPE_MAGIC)) != TAPE_MAGIC:
+			f.seek(offset)
+			return pickle.load(f)
+	return MusicTape.load(filename, offset, mmap)
+
+def file_stamp(filename):
+	# what a cached copy of a file is checked against
+	stat = os.stat(filename)
+	return (stat.st_mtime_ns, stat.st_size)
+
+class TapeCache:
+	# process-wide LRU of loaded tapes and their timeseries, bounded by the bytes of their arrays
+	# entries are keyed by file, and dropped once the file's mtime or size changes
+	# cached arrays are read-only, as they are shared by every caller
+	def __init__(self, budget = 256 << 20):
+		self.budget = budget
+		self.used = 0
+		self.entries = OrderedDict() # (filename, kind) -> (stamp, value, size)
+
+	def get(self, filename, kind, load):
+		key = (os.path.abspath(filename), kind)
+		stamp = file_stamp(filename)
+		entry = self.entries.get(key)
+		if entry is not None:
+			if entry[0] == stamp:
+				self.entries.move_to_end(key)
+				return entry[1]
+			self.__drop(key)
+
+		value = load()
+		if isinstance(value, MusicTape):
+			arrays = list(value.unpack_data())
+		elif isinstance(value, PackedSeries):
+			arrays = [value.velocity, value.newness]
+		else:
+			arrays = [value]
+		for array in arrays:
+			array.flags.writeable = False
+		size = sum([array.nbytes for array in arrays])
+
+		if size <= self.budget:
+			self.entries[key] = (stamp, value, size)
+			self.used += size
+			while self.used > self.budget:
+				self.__drop(next(iter(self.entries)))
+		return value
+
+	def invalidate(self, filename = None):
+		# drop what is cached for a file, or everything
+		path = None if filename is None else os.path.abspath(filename)
+		for key in [key for key in self.entries if path is None or key[0] == path]:
+			self.__drop(key)
+
+	def __drop(self, key):
+		self.used -= self.entries.pop(key)[2]
+
+tape_cache = TapeCache()
+
+class TapeHandle:
+	# stand-in for the tape in a tape file, loaded through tape_cache on first use
+	def __init__(self, filename, tempo, mmap = True):
+		self.filename = filename
+		self.tempo = tempo
+		self.mmap = mmap
+		self.__tape = None
+
+	def tape(self):
+		if self.__tape is None:
+			self.__tape = tape_cache.get(self.filename, ('tape', self.mmap), lambda: load_tape(self.filename, mmap = self.mmap))
+		return self.__tape
+
+	def timeseries(self, relative = False, vectorized = True, dtype = np.float64, packed = False):
+		kind = ('timeseries', relative, vectorized, np.dtype(dtype).str, packed)
+		return tape_cache.get(self.filename, kind, lambda: self.tape().timeseries(relative, vectorized, dtype, packed))
+
+	def __getattr__(self, name):
+		return getattr(self.tape(), name)
+
+def scale_velocities(held, dtype):
+	# velocity plane in a given dtype: velocity / 127 for float types, raw velocity for integer types
+	# (clipped to the type's range, so sums of several notes do not wrap)
+	if np.issubdtype(dtype, np.floating):
+		return np.true_divide(held, 127.0, dtype = dtype)
+	limits = np.iinfo(dtype)
+	return np.clip(held, limits.min, limits.max).astype(dtype)
+
+def mark_new(newness, times, notes):
+	# set bits of a packed newness plane, laid out as np.packbits lays out the note axis
+	np.bitwise_or.at(newness, (times, notes >> 3), (0x80 >> (notes & 7)).astype(np.uint8))
+
+class PackedSeries:
+	# compact (length, width, 2) timeseries:
+	# velocities in a small dtype, and newness packed 8 notes to a byte (as np.packbits along notes)
+	def __init__(self, velocity, newness, width):
+		self.velocity = velocity
+		self.newness = newness
+		self.width = width
+
+	def __len__(self):
+		return len(self.velocity)
+
+	def new(self):
+		# unpacked (length, width) newness plane
+		return np.unpackbits(self.newness, axis = 1, count = self.width).astype(bool)
+
+	def to_dense(self, dtype = np.float64):
+		output = np.zeros((len(self), self.width, 2), dtype = dtype)
+		if np.issubdtype(self.velocity.dtype, np.floating) == np.issubdtype(dtype, np.floating):
+			output[..., 0] = self.velocity
+		elif np.issubdtype(dtype, np.floating):
+			output[..., 0] = scale_velocities(self.velocity, dtype)
+		else:
+			output[..., 0] = np.round(self.velocity * 127.0)
+		output[..., 1] = self.new()
+		return output
+
+def tape_path(label, rollpath = None):
+	# file of a labelled tape - rolls keep the path their tapes were written with (often a relative windows path),
+	# so a tape missing from it is looked for next to the roll read from rollpath, where dump() writes it
+	if rollpath is not None and not os.path.isfile(label.filename):
+		return "{0}_{1}.mtp".format(rollpath[:-4], label.index)
+	return label.filename
+
+def migrate_roll(filepath):
+	# rewrite the pickled tapes of a roll in the columnar format, in place
+	roll = pickle.load(open(filepath, 'rb'))
+	if not roll.self_contained:
+		for label in roll.labels:
+			filename = tape_path(label, filepath)
+			tape = load_tape(filename, mmap = False)
+			tape.save(filename)
+	return roll
+
+combine_block = 4096 # time slices integrated at a time by combine_notes
 
 class MusicRoll:
 	def __init__(self, midipath='', labels=[],tapes=[]):
@@ -24,18 +179,22 @@ class MusicRoll:
 		return tape
 
 	# dump all tapes, delete tapes, dump roll
+	@metrics.timed('dump')
 	def dump(self, self_contained = False):
 		self.self_contained = self_contained
 		if not self_contained:
 			for label in self.labels:
 				label.filename = self.tapes[label.index].filename = "{0}_{1}.mtp".format(self.midipath[:-4], label.index)
-				pickle.dump(self.tapes[label.index], open(self.tapes[label.index].filename, 'bw'))
+				self.tapes[label.index].save(label.filename)
 
 			del self.tapes
 		pickle.dump(self, open(self.filepath, 'bw'))
 
-	def get_tape_groups(self):
+	def get_tape_groups(self, mmap = True, rollpath = None):
 		# iterate events across all tapes that belong to this roll
+		# tape files are only read when a tape is first used, and are shared through tape_cache
+		# with mmap, event columns of columnar tape files are mapped rather than read
+		# rollpath: where the roll was read from - see tape_path
 
 		# "reconstruct midi" - put all events into tempogroups
 		tempogroups = {}
@@ -44,7 +203,7 @@ class MusicRoll:
 			if self.self_contained:
 				tape = self.tapes[label.index]
 			else:
-				tape = pickle.load( open(label.filename, 'rb') )
+				tape = TapeHandle(tape_path(label, rollpath), label.tempo, mmap = mmap)
 			# add to tempogroups
 			if tape.tempo not in tempogroups:
 				tempogroups[tape.tempo] = [tape]
@@ -54,8 +213,13 @@ class MusicRoll:
 		return tempogroups
 
 	@staticmethod
-	def combine_notes(tapelist):
+	def combine_notes(tapelist, dtype = np.float64, packed = False):
 		# Interleave note and time events of tapes - WARNING: only returns note events
+		# every tape's velocity changes are written into the one output array and integrated in place,
+		# so no per-tape timeseries is built
+		# float dtypes hold velocities / 127 as timeseries does; integer dtypes hold raw velocities
+		# (clipped to the dtype, where notes held by several tapes at once sum past it)
+		# packed returns a PackedSeries, whose newness is set where any tape struck the note
 		assert all([tapelist[0].tempo == tape.tempo for tape in tapelist])
 
 		tapelist = sorted(tapelist, key = lambda tape: tape.start_time)
@@ -71,13 +235,56 @@ class MusicRoll:
 		# print("Begin ", beginning)
 		# print("End   ", end)
 		# print("Length", end - beginning)
-		output = np.zeros((end - beginning, 127, 2))
+		if packed:
+			held = np.zeros((end - beginning, 127), dtype = dtype)
+			newness = np.zeros((end - beginning, 16), dtype = np.uint8)
+		else:
+			output = np.zeros((end - beginning, 127, 2), dtype = dtype)
+			held = output[..., 0]
+
+		# changes are summed in place when dtype holds every tape's velocity at once,
+		# otherwise in a wider integer array, clipped into held a block at a time
+		most = 127 * len(tapelist)
+		if np.issubdtype(dtype, np.floating) or np.iinfo(dtype).max >= most:
+			changes = held
+		else:
+			changes = np.zeros(held.shape, dtype = np.int16 if most <= np.iinfo(np.int16).max else np.int32)
 
 		for tape in tapelist:
-			src = tape.timeseries()[:tape.length, :, :]
-			# print("Tapelen", tape.length)
-			output[tape.start_time - beginning:tape.start_time - beginning + tape.length,:] += src
-
+			times, notes, velocities, new = tape.note_changes()
+			if len(times) == 0:
+				continue
+			shift = tape.start_time - beginning
+
+			# each change holds until the next change of the same note, or the end of the tape
+			first = np.r_[True, notes[1:] != notes[:-1]]
+			deltas = velocities - np.where(first, 0, np.r_[0, velocities[:-1]])
+			# (cells are distinct within a tape, so fancy-indexed += is safe)
+			changes[times + shift, notes] += deltas.astype(changes.dtype)
+			if packed:
+				mark_new(newness, times[new] + shift, notes[new])
+			else:
+				output[times[new] + shift, notes[new], 1] += 1
+
+			last = np.r_[notes[1:] != notes[:-1], True] & (velocities > 0)
+			if shift + tape.length < len(changes):
+				changes[shift + tape.length, notes[last]] -= velocities[last].astype(changes.dtype)
+
+		# integrate the changes along time, a block at a time so no second array is needed
+		carry = np.zeros(127, dtype = changes.dtype)
+		for start in np.r_[0:len(changes):combine_block]:
+			block = changes[start:start + combine_block]
+			np.cumsum(block, 0, dtype = changes.dtype, out = block)
+			block += carry
+			carry = block[-1].copy()
+			if changes is not held:
+				held[start:start + combine_block] = scale_velocities(block, dtype)
+
+		if np.issubdtype(dtype, np.floating):
+			held /= 127.0
+
+		if packed:
+			return PackedSeries(held, newness, 127)
 		return output
 
 		# this will run into problems if tapes in the group don't end at the same time
@@ -87,6 +294,149 @@ class MusicRoll:
 		# for row in output[...,0]:
 			# print(row)
 
+	@staticmethod
+	def combine_intervals(tapelist):
+		# sparse version of combine_notes - call to_dense() on the result for the same array
+		assert all([tapelist[0].tempo == tape.tempo for tape in tapelist])
+
+		beginning = min([tape.start_time for tape in tapelist])
+		end = max([tape.start_time + tape.length for tape in tapelist])
+
+		return NoteIntervals.concatenate(
+			[(tape.intervals(), tape.start_time - beginning) for tape in tapelist],
+			end - beginning)
+
+class NoteIntervals:
+	# sparse stand-in for a (length, width, 2) timeseries
+	# each interval holds one velocity for one note over [onset, offset)
+	# new marks intervals whose onset slice has newness set
+	def __init__(self, onset, offset, pitch, velocity, new, length, width = 127):
+		self.onset = np.asarray(onset, dtype = np.int64)
+		self.offset = np.asarray(offset, dtype = np.int64)
+		self.pitch = np.asarray(pitch, dtype = np.int16)
+		self.velocity = np.asarray(velocity, dtype = np.int16) # raw midi velocity
+		self.new = np.asarray(new, dtype = bool)
+		self.length = length
+		self.width = width
+		self.__pitches = np.r_[:width] * (length + 1) # sort keys of (pitch, time 0) for window queries
+		self.__index = None
+
+	def __len__(self):
+		return len(self.onset)
+
+	def __prefix(self, times, keep, columns):
+		# running sums of columns over the kept intervals, sorted by (pitch, time):
+		# (keys, (columns, intervals + 1) sums, sums at the start of each pitch)
+		keys = self.pitch[keep].astype(np.int64) * (self.length + 1) + times[keep]
+		order = np.argsort(keys, kind = 'stable')
+		sums = np.zeros((len(columns), len(order) + 1), dtype = np.int64)
+		if len(order):
+			np.cumsum(np.stack([column[keep] for column in columns])[:, order], 1, out = sums[:, 1:])
+		keys = keys[order]
+		return (keys, sums, sums[:, keys.searchsorted(self.__pitches)])
+
+	def __window(self, start, end):
+		# per pitch over [start, end): (held velocity integral, new onset count, new onset velocity sum)
+		# from running sums built on first use - one searchsorted per index, rather than a pass over every interval
+		if self.__index is None:
+			velocity = self.velocity.astype(np.int64)
+			everything = np.ones(len(self), dtype = bool)
+			self.__index = (
+				self.__prefix(self.onset, everything, [velocity, velocity * self.onset]),
+				self.__prefix(self.offset, everything, [velocity, velocity * self.onset, velocity * (self.offset - self.onset)]),
+				self.__prefix(self.onset, self.new, [np.ones(len(self), dtype = np.int64), velocity]))
+
+		times = np.array([[start], [end]])
+		needles = self.__pitches + times
+		# sums over intervals of each pitch with onset before / offset at or before each time
+		((started, weighted_start), (ended, weighted_end, whole), (struck, struck_velocity)) = [
+			sums[:, keys.searchsorted(needles, side)] - first[:, None] for (keys, sums, first), side in zip(self.__index, ['left', 'right', 'left'])]
+		# intervals over by each time count whole; those still held, up to it
+		held = whole + times * (started - ended) - (weighted_start - weighted_end)
+		return (held[1] - held[0], struck[1] - struck[0], struck_velocity[1] - struck_velocity[0])
+
+	def __bounds(self, start, end):
+		if end is None or end > self.length:
+			end = self.length
+		return (max(start, 0), end)
+
+	def slice(self, start, end = None):
+		# intervals cut to [start, end), with time rebased to start
+		start, end = self.__bounds(start, end)
+		keep = (self.onset < end) & (self.offset > start)
+		onset = np.maximum(self.onset[keep], start)
+		return NoteIntervals(
+			onset - start,
+			np.minimum(self.offset[keep], end) - start,
+			self.pitch[keep],
+			self.velocity[keep],
+			self.new[keep] & (onset == self.onset[keep]), # newness stays at the true onset
+			max(end - start, 0),
+			self.width)
+
+	def sum(self, start = 0, end = None):
+		# same as np.sum(timeseries[start:end], 0)
+		start, end = self.__bounds(start, end)
+		output = np.zeros((self.width, 2))
+		if end > start:
+			(held, struck, _) = self.__window(start, end)
+			output[:, 0] = held / 127.0
+			output[:, 1] = struck
+		return output
+
+	def onset_sum(self, start = 0, end = None):
+		# same as np.sum(timeseries[start:end, :, 0] * timeseries[start:end, :, 1], 0)
+		# for tapes that do not overlap on a note
+		start, end = self.__bounds(start, end)
+		if end <= start:
+			return np.zeros(self.width)
+		return self.__window(start, end)[2] / 127.0
+
+	def classes(self, offset = 0):
+		# (length, 12) held velocity / 127 per pitch class and time slice
+		# (offset is the pitch class of pitch 0)
+		held = np.zeros((self.length + 1, 12))
+		pitch_class = (self.pitch + offset) % 12
+		np.add.at(held, (self.onset, pitch_class), self.velocity / 127.0)
+		np.add.at(held, (self.offset, pitch_class), -self.velocity / 127.0)
+		return np.cumsum(held, 0)[:-1]
+
+	def active(self, time):
+		# pitches sounding at a time slice
+		return np.unique(self.pitch[(self.onset <= time) & (self.offset > time) & (self.velocity > 0)])
+
+	def to_dense(self, dtype = np.float64, packed = False):
+		# materialize the full (length, width, 2) timeseries, or a PackedSeries of it
+		# (velocities are scaled as by MusicTape.timeseries)
+		held = np.zeros((self.length + 1, self.width), dtype = int)
+		np.add.at(held, (self.onset, self.pitch), self.velocity)
+		np.add.at(held, (self.offset, self.pitch), -self.velocity)
+		held = np.cumsum(held, 0)[:-1]
+
+		if packed:
+			newness = np.zeros((self.length, -(-self.width // 8)), dtype = np.uint8)
+			mark_new(newness, self.onset[self.new], self.pitch[self.new])
+			return PackedSeries(scale_velocities(held, dtype), newness, self.width)
+
+		output = np.zeros((self.length, self.width, 2), dtype = dtype)
+		output[..., 0] = scale_velocities(held, dtype)
+		np.add.at(output[..., 1], (self.onset[self.new], self.pitch[self.new]), 1)
+		return output
+
+	@staticmethod
+	def concatenate(parts, length, width = 127):
+		# merge (intervals, time shift) pairs into one set of intervals
+		parts = [(part, shift) for part, shift in parts if len(part) > 0]
+		if not parts:
+			return NoteIntervals([], [], [], [], [], length, width)
+		return NoteIntervals(
+			np.concatenate([part.onset + shift for part, shift in parts]),
+			np.concatenate([part.offset + shift for part, shift in parts]),
+			np.concatenate([part.pitch for part, shift in parts]),
+			np.concatenate([part.velocity for part, shift in parts]),
+			np.concatenate([part.new for part, shift in parts]),
+			length, width)
+
 class TapeLabel:
 	def __init__(self, index, time, tempo, has_basis, channel, unit, min_common):
 		self.index = index
@@ -102,7 +452,7 @@ class MusicTape:
 	NOTE_OFF = 0
 	BASIS_CHANGE = 2
 	TIME_CHANGE = 3
-	BYTES = 5
+	BYTES = 5 # per event, in version 1 tapes
 
 	# OTHER VARIABLES DETERMINED BY PROCESSING:
 	# initialBasis
@@ -118,7 +468,7 @@ class MusicTape:
 		self.notes = 0
 
 	def addNoteEvent(self, etype, note, velocity, time):
-		self.data.append( [etype, note, velocity, time // 256, time % 256] )
+		self.data.append( [etype, note, velocity, time] )
 		if etype == MusicTape.NOTE_ON:
 			self.notes += 1
 		if note > self.max_note:
@@ -130,32 +480,183 @@ class MusicTape:
 		self.data.append( [MusicTape.TIME_CHANGE, length // 256, length % 256, time] )
 		# self.ticks += length
 
+	@metrics.timed('finalize')
 	def finalize(self):
-		self.bytecount = len(self.data) * MusicTape.BYTES
-		self.packtype = '>' + str(self.bytecount) + 'B'
-		self.data = np.array(self.data)
+		data = np.array(self.data).reshape(-1, 4)
+		del self.data
 
-		self.ticks = np.max(self.data[:,3] * 256 + self.data[:,4])
+		self.ticks = np.max(data[:,3])
 		self.length = self.ticks - self.start_time + 1
 
-		self.data = self.data.flatten()
-		self.data = struct.pack(self.packtype, *self.data)
+		# time, type, note, velocity
+		self.columns = tuple(data[:, i].astype(dtype) for i, (name, dtype) in zip([3, 0, 1, 2], TAPE_COLUMNS))
+
+	@metrics.timed('finalize')
+	def add_events(self, time, type, note, velocity):
+		# bulk addNoteEvent + finalize, for the columns of a whole sorted event list
+		del self.data
+
+		self.notes = int(np.count_nonzero(type == MusicTape.NOTE_ON))
+		self.min_note = min(self.min_note, int(np.min(note)))
+		self.max_note = max(self.max_note, int(np.max(note)))
+
+		self.ticks = np.max(time)
+		self.length = self.ticks - self.start_time + 1
+
+		self.columns = tuple(np.asarray(column).astype(dtype) for column, (name, dtype) in zip((time, type, note, velocity), TAPE_COLUMNS))
 
 	def unpack_data(self):
-		data = struct.unpack(self.packtype, self.data)
-		return np.array(data).reshape(len(data)//MusicTape.BYTES, MusicTape.BYTES)
+		# event columns (time, type, note, velocity)
+		if not hasattr(self, 'columns'):
+			# version 1 tape - split the packed bytes without going through python ints
+			data = np.frombuffer(self.data, dtype = np.uint8).reshape(-1, MusicTape.BYTES)
+			self.columns = (
+				(data[:,3].astype(np.uint32) << 8) | data[:,4],
+				data[:,0], data[:,1].astype(np.uint16), data[:,2].astype(np.uint16))
+			del self.data
+		return self.columns
+
+	def to_bytes(self):
+		count = len(self.unpack_data()[0])
+		header = TAPE_HEADER.pack(TAPE_MAGIC, TAPE_VERSION, TAPE_HEADER_SIZE,
+			count, self.ticks, self.length, self.start_time, self.tempo, self.instrument, self.has_basis,
+			self.min_note, self.max_note, self.notes, getattr(self, 'unit', 0), getattr(self, 'min_common', 0))
+
+		chunks = [header.ljust(TAPE_HEADER_SIZE, b'\0')]
+		for column, (name, dtype) in zip(self.unpack_data(), TAPE_COLUMNS):
+			chunk = np.ascontiguousarray(column, dtype = dtype).tobytes()
+			chunks.append(chunk.ljust(-(-len(chunk) // 8) * 8, b'\0'))
+		return b''.join(chunks)
+
+	def save(self, filename):
+		# write next to the old file and swap, so mappings of the old file stay valid
+		temp = filename + '.tmp'
+		with open(temp, 'wb') as f:
+			f.write(self.to_bytes())
+		os.replace(temp, filename)
+
+	@staticmethod
+	def load(filename, offset = 0, mmap = True):
+		if mmap:
+			buffer = np.memmap(filename, dtype = np.uint8, mode = 'r')
+		else:
+			with open(filename, 'rb') as f:
+				f.seek(offset)
+				header = f.read(TAPE_HEADER_SIZE)
+				buffer = header + f.read(MusicTape.stored_size(header) - len(header))
+			offset = 0
+		tape = MusicTape.from_buffer(buffer, offset)
+		tape.filename = filename
+		return tape
 
-	def timeseries(self, relative = False):
+	@staticmethod
+	def stored_size(buffer, offset = 0):
+		# bytes taken by a stored tape, given its header
+		(magic, version, header_size, count) = TAPE_HEADER.unpack_from(buffer, offset)[:4]
+		return header_size + sum([-(-count * dtype.itemsize // 8) * 8 for name, dtype in TAPE_COLUMNS])
+
+	@staticmethod
+	def from_buffer(buffer, offset = 0):
+		# tape whose columns are views into a buffer holding a stored tape
+		(magic, version, header_size, count, ticks, length, start_time, tempo, instrument, has_basis,
+			min_note, max_note, notes, unit, min_common) = TAPE_HEADER.unpack_from(buffer, offset)
+		if magic != TAPE_MAGIC or version != TAPE_VERSION:
+			raise ValueError("Unsupported tape: {0} version {1}".format(magic, version))
+
+		tape = MusicTape(data = [], tempo = tempo, has_basis = has_basis, start_time = start_time, instrument = instrument)
+		del tape.data
+		tape.ticks = ticks
+		tape.length = length
+		tape.min_note = min_note
+		tape.max_note = max_note
+		tape.notes = notes
+		tape.unit = unit
+		tape.min_common = min_common
+
+		columns = []
+		position = offset + header_size
+		for name, dtype in TAPE_COLUMNS:
+			columns.append(np.frombuffer(buffer, dtype = dtype, count = count, offset = position))
+			position += -(-count * dtype.itemsize // 8) * 8
+		tape.columns = tuple(columns)
+		return tape
+
+	def timeseries(self, relative = False, vectorized = True, dtype = np.float64, packed = False):
 		# extract timeseries of positional note velocities for feeding into neural network
 		# time, note, [velocity, newness]
+		# float dtypes hold velocity / 127, integer dtypes (uint8) raw velocity
+		# packed returns a PackedSeries - velocities plus newness bits - instead
+		if vectorized:
+			return self.timeseries_vectorized(relative, dtype, packed)
+		return self.timeseries_loop(relative) # reference - float64 only
+
+	def note_changes(self, relative = False):
+		# collapse note events into the velocity each (time, note) cell is left at
+		# returns (times, notes, velocities, newness), sorted by note and then time
+		times, kinds, notes, velocities = self.unpack_data()
+		keep = (kinds == MusicTape.NOTE_ON) | (kinds == MusicTape.NOTE_OFF)
+
+		times = times[keep].astype(np.int64) - self.start_time
+		notes = notes[keep].astype(np.int64) - (self.min_note if relative else 0)
+		kinds, velocities = kinds[keep], velocities[keep].astype(np.int64)
+
+		# stable sort keeps event order within a cell, so the last event wins
+		order = np.argsort(notes * (self.length + 1) + times, kind = 'stable')
+		times, notes, kinds, velocities = times[order], notes[order], kinds[order], velocities[order]
+
+		last = np.r_[(times[1:] != times[:-1]) | (notes[1:] != notes[:-1]), True]
+		# a note on anywhere in the cell marks it as new
+		onsets = np.cumsum(kinds == MusicTape.NOTE_ON)
+		newness = np.diff(np.r_[0, onsets[last]]) > 0
+
+		return (times[last], notes[last], velocities[last], newness)
+
+	def timeseries_vectorized(self, relative = False, dtype = np.float64, packed = False):
+		# same output as timeseries_loop, built from note changes in a few array passes
+		width = self.max_note - self.min_note + 1 if relative else 127
+		times, notes, velocities, newness = self.note_changes(relative)
+
+		# each change holds until the next change of the same note:
+		# scatter velocity deltas, then integrate them along time
+		# (a held velocity never leaves 0-127, so int16 is wide enough throughout)
+		held = np.zeros((self.length, width), dtype = np.int16)
+		if len(times) > 0:
+			first = np.r_[True, notes[1:] != notes[:-1]]
+			deltas = velocities - np.where(first, 0, np.r_[0, velocities[:-1]])
+			held[times, notes] = deltas
+			np.cumsum(held, 0, dtype = np.int16, out = held)
+
+		if packed:
+			bits = np.zeros((self.length, -(-width // 8)), dtype = np.uint8)
+			mark_new(bits, times[newness], notes[newness])
+			return PackedSeries(scale_velocities(held, dtype), bits, width)
+
+		timeseries = np.zeros((self.length, width, 2), dtype = dtype)
+		timeseries[..., 0] = scale_velocities(held, dtype)
+		timeseries[times[newness], notes[newness], 1] = 1
+
+		return timeseries
+
+	def intervals(self, relative = False):
+		# sparse counterpart of timeseries: one interval per held velocity
+		width = self.max_note - self.min_note + 1 if relative else 127
+		times, notes, velocities, newness = self.note_changes(relative)
+
+		# a change holds until the next change of the same note, or the end of the tape
+		last = np.r_[notes[1:] != notes[:-1], True]
+		offsets = np.where(last, self.length, np.r_[times[1:], 0])
+
+		# released notes hold nothing, unless they were struck in that same slice
+		keep = (velocities > 0) | newness
+		return NoteIntervals(times[keep], offsets[keep], notes[keep], velocities[keep], newness[keep], self.length, width)
+
+	def timeseries_loop(self, relative = False):
+		# reference implementation - one python step per event
 		if relative:
 			timeseries = np.zeros((self.length, self.max_note - self.min_note + 1, 2))
 		else:
 			timeseries = np.zeros((self.length, 127, 2))
 
-		def __get_time(event):
-			return event[3] * 256 + event[4]
-
 		def relative_note(absolute_note):
 			if relative:
 				return absolute_note - self.min_note
@@ -163,11 +664,12 @@ class MusicTape:
 				return absolute_note
 
 		i = 0
-		data = self.unpack_data()
-		for event in data:
+		times = self.unpack_data()[0].tolist()
+		data = np.array(self.unpack_data()[1:], dtype = int).T.tolist() # type, note, velocity
+		for time, event in zip(times, data):
 			# move up to time
-			if i < __get_time(event) - self.start_time:
-				next_pointer = __get_time(event) - self.start_time
+			if i < time - self.start_time:
+				next_pointer = time - self.start_time
 				# only carry over note slice
 				timeseries[i + 1:next_pointer + 1, :, 0] = timeseries[i, :, 0]
 				i = next_pointer
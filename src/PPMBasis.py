@@ -9,8 +9,9 @@ www.jstor.org/stable/40285717.
 Zicheng Gao
 """
 import numpy as np
+from MusicRoll import MusicRoll
+from decay import decayed
 
-__empty = np.zeros((2, 12)) + (1 / (2*12))
 
 # Metric of contributions, not tensions
 class metric:
@@ -44,36 +45,97 @@ def note_score(note, metric):
 	note %= 12
 	return metric[..., 12-note:24-note]
 
-def group_score(group, metric):
-	(quanta, weights) = __prepare_quanta(group)
+def rotations(metric):
+	# (12, 2, 12) contributions of every pitch class: rotations(metric)[note] == note_score(note, metric)
+	return np.array([note_score(note, metric) for note in np.r_[:12]])
 
-	length = np.size(quanta, 0)
+__rotated = {} # rotations of every metric used, by contents
 
-	if length is 0:
-		return __empty
+def rotated(metric):
+	key = (metric.shape, metric.tobytes())
+	if key not in __rotated:
+		__rotated[key] = rotations(metric)
+	return __rotated[key]
 
-	output = np.zeros((2, 12))
+# rotated contribution templates of each metric
+class templates:
+	scalar = rotated(metric.scalar)
+	chordal = rotated(metric.chordal)
 
-	# move weight presence check up for performance (?)
-	if weights is not None:
-		for i in np.r_[:length]:
-			output += weights[i] * note_score(quanta[i], metric)
-	else:
-		for i in np.r_[:length]:
-			output += note_score(quanta[i], metric)
+def histogram(group):
+	# weighted pitch-class histogram of a group
+	(quanta, weights) = __prepare_quanta(group)
+	return np.bincount(quanta % 12, weights, minlength = 12).astype(float)
 
-	output = output / np.sum(output)
-	output = output * (output == np.max(output))
+def __best(scores):
+	# normalize (..., 2, 12) scores, keeping only the best
+	scores = scores / np.sum(scores, (-2, -1), keepdims = True)
+	return scores * (scores == np.max(scores, (-2, -1), keepdims = True))
 
-	return output
+def group_score(group, metric):
+	# the score is linear in the notes - weigh the rotated templates by the pitch-class histogram
+	return group_scores(histogram(group)[np.newaxis], rotated(np.asarray(metric)))[0]
+
+def group_scores(histograms, rotated):
+	# (T, 12) pitch-class histograms against (12, 2, 12) templates -> (T, 2, 12) scores
+	scores = np.einsum('tn,nmk->tmk', histograms, rotated)
+	# rows without notes score as an empty group does
+	scores[~np.any(histograms, 1)] = 1
+	return __best(scores)
 
 def get_key(group):
-	output = group_score(group, metric.scalar) + group_score(group, metric.chordal)
-	output = output / np.sum(output)
+	return get_keys(histogram(group)[np.newaxis])[0]
+
+def get_keys(histograms):
+	# get_key of every row of a (T, 12) pitch-class histogram matrix - e.g. per time slice
+	histograms = np.asarray(histograms, dtype = float)
+	output = group_scores(histograms, templates.scalar) + group_scores(histograms, templates.chordal)
+	output = output / np.sum(output, (-2, -1), keepdims = True)
 	return output
 
+def pitch_classes(notes, offset = 0):
+	# (T, N) note weights - or a (T, N, 2) timeseries, using velocities - to (T, 12) pitch-class weights
+	notes = np.asarray(notes)
+	if notes.ndim == 3:
+		notes = notes[..., 0]
+	return np.eye(12)[(np.r_[:notes.shape[1]] + offset) % 12].T.dot(notes.T).T
+
+class KeyTracker:
+	# serial key finding with decaying memory, after Vos & Van Geenen:
+	# every step, what was heard decays by decay and the step's notes are added
+	# scores are linear in the notes, so decaying the pitch-class histogram
+	# decays the scalar and chordal scores alike - one (12,) accumulator does for both
+	def __init__(self, decay = 0.9):
+		self.decay = decay
+		self.reset()
+
+	def reset(self):
+		self.heard = np.zeros(12)
+
+	def push(self, classes):
+		# take in one step's (12,) pitch-class weights, returning the (2, 12) key estimate
+		self.heard = self.decay * self.heard + classes
+		return get_keys(self.heard[np.newaxis])[0]
+
+	def track(self, classes):
+		# push every row of (T, 12) pitch-class weights, returning (T, 2, 12) key estimates
+		if len(classes) == 0:
+			return np.zeros((0, 2, 12))
+		heard = decayed(classes, self.decay, self.heard)
+		self.heard = heard[-1]
+		return get_keys(heard)
+
+def track_roll(roll, decay = 0.9, rollpath = None):
+	# key estimates for every time slice of a roll: {tempo: (T, 2, 12)}
+	# read from the sparse note intervals, so no dense timeseries is built
+	# rollpath: where the roll was read from, so its tapes are found next to it (see MusicRoll.tape_path)
+	return dict([(tempo, KeyTracker(decay).track(MusicRoll.combine_intervals(group).classes()))
+		for tempo, group in roll.get_tape_groups(rollpath = rollpath).items()])
+
 if __name__ == '__main__':
 	section = [0, 2, 4, 5, 7]
 	# print(group_score(section, metric.chordal))
 	print(get_key(section))
+	# print(get_keys(np.eye(12)))
+	# print(KeyTracker(0.5).track(np.eye(12)[section]))
 	# print(group_score([1, 5, 8], metric.scalar))
\ No newline at end of file
@@ -2,6 +2,7 @@
 # Zicheng Gao
 
 import numpy as np
+from collections import deque
 
 v_basis = np.r_[:12]
 
@@ -17,13 +18,21 @@ class TensionModule:
 	def __init__(self, metric = metric.dissonance, kertosis = 1):
 		self.metric = metric
 		self.kertosis = kertosis
+		# 3 ** metric for each interval class, indexed by (12 - interval) % 12
+		# integer intervals truncate the metric, as writing into a copy of them always has
+		self.interval_tension = 3 ** np.array(metric).astype(int)
+		self.interval_tension_float = 3.0 ** np.array(metric)
+		# tension of each pitch class (rows) against each basis (columns),
+		# and the same table spread over the 128 midi pitches
+		self.basis_table = self.mut_tens(self.__intervals(v_basis, v_basis))
+		self.pitch_table = self.basis_table[np.r_[:128] % 12]
 
 	def mut_tens(self, intvs):
 		# change to tensions
-		tens = np.tile(intvs, (1,1))
-		for i in np.r_[:12]:
-			tens[intvs == (12 - i) % 12] = self.metric[i]
-		return 3 ** tens
+		intvs = np.asarray(intvs)
+		if intvs.dtype.kind == 'f':
+			return self.interval_tension_float[(12 - intvs.astype(int)) % 12]
+		return self.interval_tension[(12 - intvs) % 12]
 
 	@staticmethod
 	def __intervals(bases, quanta):
@@ -56,6 +65,10 @@ class TensionModule:
 			noteamt = np.sum(weights)
 		return np.sum(tens) / ((noteamt**2 - noteamt) * 3**4)
 
+	def stream(self, offset = 0, window = None):
+		# running selfTension over consecutive time slices - see TensionStream
+		return TensionStream(self, offset, window)
+
 	def inversionIntervals(quanta):
 		# return intervals of the inversions of this note group
 		qlen = len(quanta)
@@ -83,6 +96,30 @@ class TensionModule:
 		tensionList = np.sum(tens, 0)
 		return self.flipmax(tensionList)
 
+	def basis_likelihoods(self, weights, offset = 0, threshold = None):
+		# batched basis_likelihood: one row of likelihoods per time slice
+		# weights is (T, pitches), column p holding the weight of note p + offset,
+		# or a (T, pitches, 2) timeseries, whose velocities are used as weights
+		# weights at or below threshold are dropped, as a caller of basis_likelihood would
+		weights = np.asarray(weights)
+		if weights.ndim == 3:
+			weights = weights[..., 0]
+		if threshold is not None:
+			weights = np.where(weights > threshold, weights, 0)
+
+		notes = np.r_[:np.size(weights, 1)] + offset
+		if offset == 0 and len(notes) <= 128:
+			table = self.pitch_table[:len(notes)]
+		else:
+			table = self.basis_table[notes % 12]
+
+		with np.errstate(divide = 'ignore', invalid = 'ignore'):
+			likelihoods = self.flipmax(np.dot(weights, table))
+
+		# slices without notes (other than note 0) are uniform, as in basis_likelihood
+		likelihoods[~np.any(weights[:, notes != 0] != 0, 1)] = 1/12
+		return likelihoods
+
 	def determineBasis(self, notes, tolerance=0, verbose=False):
 		# print out as well - has internal trim
 		if verbose:
@@ -96,10 +133,59 @@ class TensionModule:
 			print()
 		return best
 
-	# the recently made-up cousin of softmax
+	# the recently made-up cousin of softmax - along the last axis
 	def flipmax(self, x):
-		return (1 / (x ** self.kertosis)) / np.sum(1 / (x ** self.kertosis))
+		return (1 / (x ** self.kertosis)) / np.sum(1 / (x ** self.kertosis), -1, keepdims = True)
+
+
+class TensionStream:
+	# selfTension of a run of time slices, kept up to date as slices come and go
+	# selfTension only depends on the pitch-class weight totals W:
+	#	sum over note pairs of w_i * w_j * tension(interval) = W . basis_table . W
+	# so each added or removed slice costs O(12 x 12), however long the window is.
+	# window = None grows until pop() or reset(); otherwise the oldest slice drops out
+	def __init__(self, module, offset = 0, window = None):
+		self.module = module
+		self.offset = offset # slice column p holds note p + offset
+		self.window = window
+		self.reset()
+
+	def reset(self):
+		self.totals = np.zeros(12)
+		self.slices = deque()
+
+	def __len__(self):
+		return len(self.slices)
+
+	def classes(self, weights):
+		# fold (..., pitches) weights into (..., 12) pitch-class weights
+		weights = np.asarray(weights)
+		return np.dot(weights, np.eye(12)[(np.r_[:np.size(weights, -1)] + self.offset) % 12])
+
+	def push(self, weights):
+		# add a slice of per-pitch weights, returning the new tension
+		return self.push_classes(self.classes(weights))
+
+	def push_classes(self, classes):
+		self.totals += classes
+		self.slices.append(classes)
+		if self.window is not None and len(self.slices) > self.window:
+			self.pop()
+		return self.tension()
+
+	def pop(self):
+		# drop the oldest slice
+		self.totals -= self.slices.popleft()
+		if not self.slices:
+			self.totals[:] = 0 # no rounding residue once empty
+		return self.tension()
 
+	def tension(self):
+		# same as module.selfTension of the (note, weight) pairs in the window
+		noteamt = np.sum(self.totals)
+		if noteamt**2 - noteamt == 0:
+			return 0.0 # no pairs of notes (an empty window, or a total weight of 1)
+		return np.dot(self.totals, np.dot(self.module.basis_table, self.totals)) / ((noteamt**2 - noteamt) * 3**4)
 
 #################################################################
 # Thoughts & possible future additions
@@ -0,0 +1,243 @@
+# Benchmarks of the pipeline stages
+# midi stages (mido parse, midi parse, normalize, dump) run on copies of data/bach, in a scratch folder;
+# roll stages (load onwards) run on the prebuilt rolls under src/mid.
+# Every stage reports wall time, events per second and peak resident memory;
+# results are saved as json, and can be compared against an earlier run.
+#
+#	python benchmark.py [-o results.json] [--compare earlier.json] [--limit N]
+
+import os
+import io
+import json
+import time
+import shutil
+import pickle
+import argparse
+import platform
+import tempfile
+import threading
+import contextlib
+import subprocess
+import numpy as np
+from mido import MidiFile
+
+import midiparse
+import midinormalizer
+import TensionModule
+import PPMBasis
+import midibasis
+from MusicRoll import MusicRoll
+from rollarchive import roll_tapes
+
+here = os.path.dirname(os.path.abspath(__file__))
+default_midis = os.path.join(here, '..', 'data', 'bach')
+default_rolls = os.path.join(here, 'mid')
+
+def files_under(folder, *extensions):
+	found = []
+	for root, dirs, files in os.walk(folder):
+		for file in files:
+			if file.endswith(extensions):
+				found.append(os.path.join(root, file))
+	return sorted(found)
+
+def spread(items, limit):
+	# an evenly spaced, fixed subset - the same files every run
+	if limit is None or limit >= len(items):
+		return items
+	return [items[i] for i in np.linspace(0, len(items) - 1, limit).astype(int)]
+
+def rss():
+	# resident set size in bytes
+	try:
+		with open('/proc/self/statm') as f:
+			return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+	except (OSError, ValueError):
+		import resource
+		return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class PeakRSS:
+	# highest rss seen while in the block, sampled from a thread
+	def __init__(self, interval = 0.002):
+		self.interval = interval
+
+	def __enter__(self):
+		self.start = self.peak = rss()
+		self.done = threading.Event()
+		self.thread = threading.Thread(target = self.__sample, daemon = True)
+		self.thread.start()
+		return self
+
+	def __sample(self):
+		while not self.done.wait(self.interval):
+			self.peak = max(self.peak, rss())
+
+	def __exit__(self, *args):
+		self.done.set()
+		self.thread.join()
+		self.peak = max(self.peak, rss())
+
+class Benchmark:
+	def __init__(self, repeat = 1):
+		self.repeat = repeat
+		self.stages = {}
+
+	def stage(self, name, unit, function, items):
+		# run function over every item (best of repeat runs); function returns the events it handled
+		best = None
+		with PeakRSS() as memory:
+			for run in range(self.repeat):
+				events = 0
+				failures = 0
+				start = time.perf_counter()
+				with contextlib.redirect_stdout(io.StringIO()):
+					for item in items:
+						try:
+							events += function(item)
+						except Exception:
+							failures += 1
+				elapsed = time.perf_counter() - start
+				best = elapsed if best is None else min(best, elapsed)
+
+		self.stages[name] = {
+			'seconds': best,
+			'events': events,
+			'unit': unit,
+			'events_per_second': events / best if best > 0 else None,
+			'peak_rss_mb': memory.peak / 2**20,
+			'rss_growth_mb': (memory.peak - memory.start) / 2**20,
+			'items': len(items),
+			'failures': failures,
+			}
+		print("{0:<18} {1:>9.3f}s {2:>12.0f} {3:<7}/s {4:>8.1f} MB peak {5:>3} failed".format(
+			name, best, self.stages[name]['events_per_second'] or 0, unit, memory.peak / 2**20, failures))
+		return self.stages[name]
+
+def run(midis, rolls, repeat = 1):
+	bench = Benchmark(repeat)
+	scratch = tempfile.mkdtemp(prefix = 'benchmark_')
+	try:
+		# midi stages, on copies so no rolls are written into the corpus
+		copies = []
+		for i, path in enumerate(midis):
+			copies.append(os.path.join(scratch, "{0}_{1}".format(i, os.path.basename(path))))
+			shutil.copyfile(path, copies[-1])
+
+		# mido, for reference - normalization reads with midiparse
+		bench.stage('mido parse', 'msgs', lambda path: sum([len(track) for track in MidiFile(path).tracks]), copies)
+
+		parsed = {}
+		def parse(path):
+			parsed[path] = midiparse.read(path)
+			return len(parsed[path])
+		bench.stage('midi parse', 'msgs', parse, copies)
+
+		normalized = {}
+		def normalize(path):
+			roll = MusicRoll(path, labels = [], tapes = [])
+			midinormalizer.MidiNormalizer(roll, parsed[path]).normalize(chop_loss_percent = 0.002)
+			normalized[path] = roll
+			return sum([len(tape.unpack_data()[0]) for tape in roll.tapes])
+		bench.stage('normalize', 'events', normalize, copies)
+
+		def dump(path):
+			roll = normalized[path]
+			events = sum([len(tape.unpack_data()[0]) for tape in roll.tapes])
+			tapes = roll.tapes
+			roll.dump(self_contained = False)
+			roll.tapes = tapes # dump drops them - keep them for the next run
+			return events
+		bench.stage('dump', 'events', dump, list(normalized))
+	finally:
+		shutil.rmtree(scratch)
+
+	# roll stages
+	loaded = {}
+	def load(path):
+		roll = pickle.load(open(path, 'rb'))
+		groups = {}
+		for tape in roll_tapes(roll, path):
+			groups.setdefault(tape.tempo, []).append(tape)
+		loaded[path] = (roll, groups)
+		return sum([len(tape.unpack_data()[0]) for group in groups.values() for tape in group])
+	bench.stage('load', 'events', load, rolls)
+
+	tapes = [tape for roll, groups in loaded.values() for group in groups.values() for tape in group]
+	def timeseries(tape):
+		tape.timeseries()
+		return len(tape.unpack_data()[0])
+	bench.stage('timeseries', 'events', timeseries, tapes)
+
+	groups = [group for roll, groups in loaded.values() for group in groups.values()]
+	combined = []
+	def combine(group):
+		combined.append(MusicRoll.combine_notes(group))
+		return len(combined[-1])
+	bench.stage('combine_notes', 'slices', combine, groups)
+
+	tens_mod = TensionModule.TensionModule(TensionModule.metric.western)
+	bench.stage('basis_likelihoods', 'slices', lambda notes: len(tens_mod.basis_likelihoods(notes, 3, 0.0001)), combined)
+	bench.stage('get_key', 'slices', lambda notes: len(PPMBasis.get_keys(PPMBasis.pitch_classes(notes))), combined)
+
+	def label(path):
+		# the loaded rolls may point at tapes elsewhere - label through self contained copies
+		(roll, groups) = loaded[path]
+		roll.tapes = [tape for group in groups.values() for tape in group]
+		roll.self_contained = True
+		return sum([len(labelling.tension) for labelling in midibasis.label_roll(roll, TensionModule.metric.western).values()])
+	bench.stage('basis labelling', 'slices', label, rolls)
+
+	return bench.stages
+
+def environment():
+	try:
+		commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd = here, stderr = subprocess.DEVNULL).decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		commit = None
+	return {
+		'commit': commit,
+		'python': platform.python_version(),
+		'numpy': np.__version__,
+		'machine': platform.machine(),
+		'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+		}
+
+def compare(results, earlier):
+	# ratio of events per second against an earlier run - above 1 is faster
+	print("\n{0:<18} {1:>12} {2:>12} {3:>8} {4:>10}".format('stage', 'before/s', 'after/s', 'speedup', 'peak MB'))
+	for name, stage in results['stages'].items():
+		before = earlier['stages'].get(name)
+		if before is None or not before['events_per_second'] or not stage['events_per_second']:
+			print("{0:<18} {1:>12}".format(name, 'new'))
+			continue
+		print("{0:<18} {1:>12.0f} {2:>12.0f} {3:>7.2f}x {4:>+10.1f}".format(name,
+			before['events_per_second'], stage['events_per_second'],
+			stage['events_per_second'] / before['events_per_second'],
+			stage['peak_rss_mb'] - before['peak_rss_mb']))
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description = "Benchmark the pipeline stages.")
+	parser.add_argument('--midis', default = default_midis, help = "folder of midi files for the midi stages")
+	parser.add_argument('--rolls', default = default_rolls, help = "folder of prebuilt rolls for the roll stages")
+	parser.add_argument('--limit', type = int, default = 24, help = "midi files to use, spread over the folder (0 for all)")
+	parser.add_argument('--repeat', type = int, default = 1, help = "runs per stage - the best is kept")
+	parser.add_argument('-o', '--output', default = 'benchmark.json')
+	parser.add_argument('--compare', help = "earlier results to compare against")
+	args = parser.parse_args()
+
+	midis = spread(files_under(args.midis, '.mid', '.MID'), args.limit or None)
+	rolls = files_under(args.rolls, '.mrl')
+	print("{0} midi files, {1} rolls".format(len(midis), len(rolls)))
+
+	results = environment()
+	results['midis'] = [os.path.relpath(path, args.midis) for path in midis]
+	results['rolls'] = [os.path.relpath(path, args.rolls) for path in rolls]
+	results['stages'] = run(midis, rolls, args.repeat)
+
+	with open(args.output, 'w') as f:
+		json.dump(results, f, indent = 1)
+	print("Saved '{0}'".format(args.output))
+
+	if args.compare:
+		with open(args.compare) as f:
+			compare(results, json.load(f))
@@ -0,0 +1,83 @@
+# Build manifest for incremental normalization
+# Records, per midi file, the key its outputs were built with:
+# (midi content hash, normalizer code version, normalization parameters).
+# Outputs are rebuilt exactly when that key changes or an output goes missing.
+
+import os
+import json
+import hashlib
+
+MANIFEST_NAME = '.normalize_manifest.json'
+MANIFEST_VERSION = 1
+
+def file_hash(path):
+	hash_sha1 = hashlib.sha1()
+	with open(path, 'rb') as f:
+		for chunk in iter(lambda: f.read(1 << 16), b""):
+			hash_sha1.update(chunk)
+	return hash_sha1.hexdigest()
+
+def build_key(content, code_version, params):
+	text = json.dumps([content, code_version, params], sort_keys = True)
+	return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+class BuildManifest:
+	def __init__(self, folder):
+		self.folder = folder
+		self.filename = os.path.join(folder, MANIFEST_NAME)
+		self.entries = {}
+		if os.path.isfile(self.filename):
+			with open(self.filename) as f:
+				manifest = json.load(f)
+			if manifest.get('version') == MANIFEST_VERSION:
+				self.entries = manifest['entries']
+
+	def __name(self, path):
+		return os.path.relpath(path, self.folder)
+
+	def content_hash(self, path):
+		# reuse the recorded hash while the file's size and mtime are unchanged
+		stat = os.stat(path)
+		entry = self.entries.get(self.__name(path))
+		if entry is not None and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+			return entry['content']
+		return file_hash(path)
+
+	def is_current(self, path, key):
+		entry = self.entries.get(self.__name(path))
+		if entry is None or entry['key'] != key:
+			return False
+		# outputs that were removed or rewritten since also need a rebuild
+		for output, size in entry['outputs'].items():
+			output = os.path.join(self.folder, output)
+			if not os.path.isfile(output) or os.path.getsize(output) != size:
+				return False
+		return True
+
+	def record(self, path, content, key, outputs):
+		# note a finished build; outputs of an earlier build that were not written again are removed
+		name = self.__name(path)
+		outputs = dict([(self.__name(output), os.path.getsize(output)) for output in outputs])
+		if name in self.entries:
+			for output in self.entries[name]['outputs']:
+				if output not in outputs and os.path.isfile(os.path.join(self.folder, output)):
+					os.remove(os.path.join(self.folder, output))
+
+		stat = os.stat(path)
+		self.entries[name] = {
+			'size': stat.st_size,
+			'mtime_ns': stat.st_mtime_ns,
+			'content': content,
+			'key': key,
+			'outputs': outputs,
+			}
+
+	def forget(self, path):
+		self.entries.pop(self.__name(path), None)
+
+	def save(self):
+		# write next to the old manifest and swap, so an interrupted run leaves a usable one
+		temp = self.filename + '.tmp'
+		with open(temp, 'w') as f:
+			json.dump({'version': MANIFEST_VERSION, 'entries': self.entries}, f, indent = 1, sort_keys = True)
+		os.replace(temp, self.filename)
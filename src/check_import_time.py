@@ -0,0 +1,39 @@
+# Import cost of a worker that only loads rolls and computes features
+# Imports the feature modules in a fresh interpreter (after numpy, which every worker needs anyway)
+# and checks the time taken and that no plotting, gui, midi parsing or profiling modules came with them.
+#
+#	python check_import_time.py
+
+import os
+import sys
+import json
+import subprocess
+
+modules = ['MusicRoll', 'rollarchive', 'TensionModule', 'PPMBasis', 'midibasis', 'midinormalizer', 'rolldataset']
+heavy = ['mido', 'matplotlib', 'mpl_toolkits', 'tkinter', 'cProfile']
+limit = 0.1 # seconds
+
+probe = '''
+import sys, json, time
+import numpy
+start = time.perf_counter()
+for name in {0!r}:
+	__import__(name)
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'loaded': [name for name in {1!r} if name in sys.modules]}}))
+'''.format(modules, heavy)
+
+def measure():
+	here = os.path.dirname(os.path.abspath(__file__))
+	output = subprocess.check_output([sys.executable, '-c', probe], cwd = here)
+	return json.loads(output.decode())
+
+if __name__ == "__main__":
+	measure() # first run may compile the modules
+	runs = [measure() for run in range(3)]
+	result = min(runs, key = lambda run: run['seconds'])
+	print("{0} imported in {1:.1f}ms (best of 3)".format(', '.join(modules), result['seconds'] * 1000))
+
+	assert not result['loaded'], "heavy modules loaded: {0}".format(result['loaded'])
+	assert result['seconds'] < limit, "import took {0:.3f}s (limit {1}s)".format(result['seconds'], limit)
+	print("OK")
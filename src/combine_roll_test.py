@@ -1,4 +1,6 @@
-from MusicRoll import *
+import pickle
+import numpy as np
+from MusicRoll import MusicRoll
 import pprint
 
 filename = './mid/bach/aof/can1.mrl'
@@ -21,4 +23,16 @@ for tempo, group in roll.get_tape_groups().items():
 
 	print(np.sum(notes_data[...,1]))
 	print(np.sum(notes_data[122:144,:,1]))
-	print(sum_notes)
\ No newline at end of file
+	print(sum_notes)
+
+	# the sparse intervals should agree without building the dense array
+	notes_intervals = MusicRoll.combine_intervals(group)
+
+	print(np.sum(notes_intervals.sum()[...,1]))
+	print(np.sum(notes_intervals.sum(122, 144)[...,1]))
+
+	# compact form: uint8 velocities and newness bits
+	notes_packed = MusicRoll.combine_notes(group, np.uint8, packed = True)
+
+	print(np.sum(notes_packed.new()))
+	print(notes_packed.velocity.nbytes + notes_packed.newness.nbytes, "bytes packed, against", notes_data.nbytes)
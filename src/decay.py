@@ -0,0 +1,25 @@
+# Exponentially decaying running sums, shared by the key tracker (PPMBasis) and the labeller (midibasis)
+# h[t] = decay * h[t-1] + x[t] is a lower triangular matrix product within a block of steps,
+# with the last sum of each block carried into the next.
+
+import numpy as np
+
+block = 128 # time steps per matrix product
+
+def decayed(classes, decay, carry = None):
+	# running sums h[t] = decay * h[t-1] + classes[t] along the first axis, a block of steps per matrix product
+	classes = np.asarray(classes, dtype = float)
+	output = np.empty_like(classes)
+	carry = np.zeros(classes.shape[1:]) if carry is None else carry
+
+	steps = np.r_[:block]
+	lags = np.subtract.outer(steps, steps)
+	lower = np.where(lags >= 0, decay ** np.maximum(lags, 0), 0) # decay^(i-j) for j <= i
+	carried = decay ** (steps + 1)
+
+	for start in np.r_[0:len(classes):block]:
+		rows = classes[start:start + block]
+		n = len(rows)
+		output[start:start + n] = np.tensordot(lower[:n, :n], rows, 1) + np.multiply.outer(carried[:n], carry)
+		carry = output[start + n - 1]
+	return output
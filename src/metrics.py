@@ -0,0 +1,128 @@
+# Instrumentation: named timers and counters, collected per file, and an optional profiler
+# Nothing is collected unless enabled (or inside record) - disabled timers and counters are a flag check.
+#
+#	with metrics.record(path) as file_metrics:
+#		... (code using metrics.timer / metrics.timed / metrics.count)
+#	total.merge(file_metrics)
+
+import time
+import functools
+import contextlib
+
+enabled = False
+
+class Metrics:
+	# timers (seconds, calls) and counters of one file, or of many merged
+	def __init__(self, name = ''):
+		self.name = name
+		self.timers = {}
+		self.counters = {}
+
+	def add_time(self, name, seconds, calls = 1):
+		(total, count) = self.timers.get(name, (0.0, 0))
+		self.timers[name] = (total + seconds, count + calls)
+
+	def count(self, name, amount = 1):
+		self.counters[name] = self.counters.get(name, 0) + amount
+
+	def merge(self, other):
+		for name, (seconds, calls) in other.timers.items():
+			self.add_time(name, seconds, calls)
+		for name, amount in other.counters.items():
+			self.count(name, amount)
+		return self
+
+	def to_json(self):
+		return {
+			'name': self.name,
+			'timers': dict([(name, {'seconds': seconds, 'calls': calls}) for name, (seconds, calls) in self.timers.items()]),
+			'counters': dict(self.counters),
+			}
+
+	@staticmethod
+	def from_json(entry):
+		metrics = Metrics(entry['name'])
+		for name, timer in entry['timers'].items():
+			metrics.add_time(name, timer['seconds'], timer['calls'])
+		metrics.counters = dict(entry['counters'])
+		return metrics
+
+	def report(self):
+		lines = []
+		for name, (seconds, calls) in sorted(self.timers.items(), key = lambda item: -item[1][0]):
+			lines.append("{0:<20} {1:>9.3f}s {2:>8} calls".format(name, seconds, calls))
+		for name, amount in sorted(self.counters.items()):
+			lines.append("{0:<20} {1:>10}".format(name, amount))
+		return '\n'.join(lines)
+
+current = Metrics()
+
+class Timer:
+	def __init__(self, name):
+		self.name = name
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *args):
+		current.add_time(self.name, time.perf_counter() - self.start)
+
+class Idle:
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		pass
+
+idle = Idle()
+
+def timer(name):
+	# with metrics.timer(name): ...
+	return Timer(name) if enabled else idle
+
+def timed(name):
+	# decorator - time every call of a function under name
+	def wrap(function):
+		@functools.wraps(function)
+		def timed_function(*args, **kwargs):
+			if not enabled:
+				return function(*args, **kwargs)
+			start = time.perf_counter()
+			try:
+				return function(*args, **kwargs)
+			finally:
+				current.add_time(name, time.perf_counter() - start)
+		return timed_function
+	return wrap
+
+def count(name, amount = 1):
+	if enabled:
+		current.count(name, amount)
+
+@contextlib.contextmanager
+def record(name, enable = True):
+	# collect into a fresh Metrics for the duration (only if enable)
+	global current, enabled
+	saved = (current, enabled)
+	current = Metrics(name)
+	enabled = enable
+	try:
+		yield current
+	finally:
+		(current, enabled) = saved
+
+@contextlib.contextmanager
+def profile(filename = None):
+	# cProfile the block into filename (for pstats / snakeviz) - does nothing without one
+	if filename is None:
+		yield None
+		return
+	import cProfile
+	profiler = cProfile.Profile()
+	profiler.enable()
+	try:
+		yield profiler
+	finally:
+		profiler.disable()
+		profiler.dump_stats(filename)
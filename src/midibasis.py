@@ -5,24 +5,23 @@
 
 # Zicheng (Brian) Gao
 
-from MusicRoll import *
+from MusicRoll import MusicRoll
 import TensionModule
-import PPMBasis
+from decay import decayed
 import numpy as np
 import pickle
-import pprint
+import sys
+import metrics
 
-from tkinter import Tk, Button, Frame, Canvas, Scrollbar
-import tkinter.constants as Tkconstants
+# plotting (matplotlib) is only imported by render_basis_label,
+# so labelling itself runs on machines without a display
 
-import matplotlib.pyplot as plt
-from mpl_toolkits.axes_grid1 import AxesGrid
-# from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-
-__verbose = False
+# verbosity: 0 - nothing; 1 - progress through each group; 2 - every labelling decision
+verbosity = 0
+report_interval = 100 # time slices between progress reports
 __block = True
-__report_interval = 100
 __hard_limit = 1000
+__batch = 4096 # time slices per batched likelihood call
 
 # parameters:
 
@@ -40,16 +39,39 @@ thresh_conf = 0.25
 persistence = 0.25
 
 def debug_print(*args):
-	if __verbose:
+	if verbosity >= 2:
 		print(args)
 		
 def ema(seq, inertia):
 	# mutating operation: exponential moving average applied over an array
+	# seq[i] = inertia * seq[i-1] + (1 - inertia) * seq[i], over the first axis
+	if np.size(seq, 0) > 1:
+		inputs = (1 - inertia) * np.asarray(seq, dtype = float)
+		inputs[0] = seq[0]
+		seq[...] = decayed(inputs, inertia)
+	return seq
+
+def ema_loop(seq, inertia):
+	# reference implementation of ema - one python step per row
 	for i in np.r_[1:np.size(seq, 0)]:
 		seq[i] = inertia * seq[i-1] + (1 - inertia) * seq[i]
 	return seq
 
+def window_sum(origin, width):
+	# sums over the first axis of the width rows before each row (fewer at the start):
+	# apply_with_window(origin, target, lambda w: np.sum(w, 0), width), from one cumulative sum
+	totals = np.cumsum(np.concatenate((np.zeros((1,) + np.shape(origin)[1:]), origin)), 0)
+	ends = np.r_[:np.size(origin, 0)]
+	return totals[ends] - totals[np.maximum(ends - width, 0)]
+
+def window_mean(origin, width):
+	# as window_sum, with lambda w: np.mean(w, 0) - the first row has no window, and is nan
+	counts = np.minimum(np.r_[:np.size(origin, 0)], width).reshape((-1,) + (1,) * (np.ndim(origin) - 1))
+	with np.errstate(invalid = 'ignore', divide = 'ignore'):
+		return window_sum(origin, width) / counts
+
 def apply_with_window(origin, target, vfunction, width, wdirection = 'backwards'):
+	# general form - see window_sum and window_mean for sums and means
 	# wdirection must either be 'forwards' or 'backwards'
 	assert np.size(origin, 0) == np.size(target, 0)
 
@@ -68,196 +90,297 @@ def matches(belief, actual):
 	# How much does the observed value match the hypothesis
 	return 1 - np.linalg.norm(belief - actual)
 
-def do_basis_label(filename, metric = TensionModule.metric.dissonance):
-	pp = pprint.PrettyPrinter(indent=4)
-	roll = pickle.load(open(filename, 'rb'))
-	pp.pprint(vars(roll))
-
+class BasisLabelling:
+	# labelling of one tempo group of a roll
+	#	basis_label: (duration, 1) basis per time slice, -1 where unlabelled
+	#	basis_prob: (duration, 12) basis likelihoods seen at each slice
+	#	tension: (duration,) tension of the section being read at each slice
+	#	marks: what the labeller did, for render_basis_label
+	#		('label', base, start, end), ('bar', time), ('block', base, start, end, color)
+	def __init__(self, tempo, note_data, basis_label, basis_prob, tension, marks, min_note, max_note):
+		self.tempo = tempo
+		self.note_data = note_data
+		self.basis_label = basis_label
+		self.basis_prob = basis_prob
+		self.tension = tension
+		self.marks = marks
+		self.min_note = min_note
+		self.max_note = max_note
+
+	def notes(self, dtype = np.float64):
+		# attention-weighted notes over the labelled duration, as the labeller saw them
+		dense = self.note_data.slice(0, len(self.tension)).to_dense(dtype)
+		notes = dense[...,0] * (1 - attn_decay * (dense[...,1] - 1))
+		return ema(notes, n_smoothing) if n_smoothing else notes
+
+@metrics.timed('basis_labelling')
+def label_group(group, tens_mod, hard_limit = None):
+	# label the bases of one tempo group of tapes - no plotting
+	max_gap = 2 * max([tape.min_common for tape in group])
+
+	note_data = MusicRoll.combine_intervals(group)
+
+	# Array - newness matters - simulate attentional decay
+	# @newness = 0 -> 1-k
+	# @newness = 1 -> 1
+	# factor = (1-k) + n * k
+	# 		 = 1 - k + nk = 1 - k * (n - 1)
+	duration = note_data.length if hard_limit is None else min(note_data.length, hard_limit)
+
+	if n_smoothing:
+		# smoothing needs every slice - fall back to the dense array
+		dense = note_data.slice(0, duration).to_dense()
+		notes = ema(dense[...,0] * (1 - attn_decay * (dense[...,1] - 1)), n_smoothing)
+
+		def notes_at(start, end):
+			return notes[start:end]
+
+		def notes_over(start, end):
+			return np.sum(notes[start:end], 0)
+	else:
+		# the same sums, read straight off the note intervals
+		def notes_at(start, end):
+			dense = note_data.slice(start, end).to_dense()
+			return dense[...,0] * (1 - attn_decay * (dense[...,1] - 1))
+
+		def notes_over(start, end):
+			held = note_data.sum(start, end)[:,0]
+			return (1 + attn_decay) * held - attn_decay * note_data.onset_sum(start, end)
+
+	basis_prob = np.zeros((duration, 12)) 	  # likelihoods
+	basis_label = np.zeros((duration, 1)) - 1 # labels
+	tension = np.zeros(duration)
+	marks = []
+
+	def axis_basis(quanta):
+		# offset 3 due to midi pitch nonsense - 0 is C
+		return tens_mod.basis_likelihoods(quanta[np.newaxis], 3, 0.0001)[0]
+
+	tension_stream = tens_mod.stream(offset = 3)
+	tension_start = 0 # time slice at the front of the stream
+
+	# likelihoods and pitch-class weights of single slices, in batches
+	slice_basis = np.zeros((duration, 12))
+	slice_classes = np.zeros((duration, 12))
+	for start in np.r_[0:duration:__batch]:
+		chunk = notes_at(start, min(start + __batch, duration))
+		slice_basis[start:start + len(chunk)] = tens_mod.basis_likelihoods(chunk, 3, 0.0001)
+		slice_classes[start:start + len(chunk)] = tension_stream.classes(chunk)
+
+	def label(base, start, end):
+		if start == 0:
+			start -= 1
+		marks.append(('label', base, start, end))
+		basis_label[start + 1:end] = base
+
+	def bar(time):
+		marks.append(('bar', time))
+
+	def block(base, start, end, color):
+		marks.append(('block', base, start, end, color))
+
+	# go through the time slices...
+	left = 0
+	right = 0
+	reach = 0
+	candidate = None
+	confidence = 0 # SHOULD BE USED
+
+	def section_tension():
+		# tension of notes[left:right+1], streamed a slice at a time
+		nonlocal tension_start
+		if tension_start != left:
+			tension_stream.reset()
+			tension_start = left
+		while tension_start + len(tension_stream) <= right:
+			tension_stream.push_classes(slice_classes[tension_start + len(tension_stream)])
+		return tension_stream.tension()
+
+	def notes_in_time(start, end):
+		return np.sum(note_data.sum(start, end)[:,1])
+
+	def label_basis():
+		if candidate == None:
+			for base in TensionModule.v_basis[b_curr == np.max(b_curr)]:
+				label(base, left - 1, right + 1)
+		else:
+			label(candidate, left - 1, right + 1)
+
+	def get_cand(notes):
+		# return (candidate, confidence)
+		return (trim(b_curr, b_ambiguous), np.max(b_curr))
+
+	while right < duration:
+		# report
+		if verbosity >= 1 and right % report_interval == 0:
+			print('{0}/{1}...'.format(right, duration))
+
+		# If we didn't have a candidate, try to check for one
+		if candidate == None:
+			# get current hypothesis from accumulated notes
+			confidence_factor = 1 - 1/(notes_in_time(left, right + 1) + 1)
+			section = notes_over(left, right + 1)
+
+			b_curr = axis_basis(section) * confidence_factor
+
+			basis_prob[right] = b_curr
+			tension[right] = section_tension()
+
+			(try_cand, try_conf) = get_cand(b_curr)
+
+			# make sure there is only one candidate, and that it is confident enough
+			if np.sum(try_cand) == 1 and try_conf > thresh_conf:
+				# found a candidate
+				debug_print('got', right, try_cand, try_conf)
+				block(-0.5, right - 1, right, 'purple')
+				candidate = TensionModule.v_basis[try_cand > b_ambiguous][0]
+				confidence = try_conf
+			else:
+				# no candidate / still ambiguous
+				if np.sum(try_cand) > 1:
+					debug_print('non', right, 'multiple')
+				else:
+					debug_print('non', right, try_conf, '<', thresh_conf)
+				block(-0.5, right - 1, right, 'blue')
+		# If there is a candidate, check to see if the next observed slice follows
+		else:
+			reach = 0
+			similarity = -1
+
+			# attempt to bridge gap if dissimilarity is seen
+			while reach < max_gap and right + reach < duration and similarity < persistence:
+				# check if the following slice fits the hypothesis
+				# section = np.vstack((notes[left:right+1], notes[right + reach]))
+				# b_next = axis_basis(np.sum(section, 0))
+				b_next = slice_basis[right + reach]
+				(try_cand, try_conf) = get_cand(b_next)
+
+				# similarity = matches(trim(b_curr, b_ambiguous, 1), b_next)
+				similarity = b_next[candidate]
+				debug_print('chk', right, right + reach, 'cnd', candidate, similarity)
+				reach += 1
+
+			# exited due to similarity - can extend
+			if similarity >= persistence or right + reach >= duration:
+				block(-0.5, right - 1, right, 'green')
+
+				debug_print('ext', right, similarity)
+				# all's right - we can aggregate this slice
+				# basis_prob[right] = b_curr = axis_basis(notes_over(left, right + 1))
+				basis_prob[right] = b_curr = slice_basis[right]
+				tension[right] = section_tension()
+			# a gap was found and was too large
+			elif similarity < persistence and reach >= max_gap:
+				block(0, right - 1, right, 'yellow')
+				debug_print('rev', right, similarity, list(b_next))
+				bar(right)
+				right -= 1
+				label_basis()
+				candidate = None
+				left = right + 1
+
+		right += 1
+
+		# back-label
+
+	# label when hitting end
+	label_basis()
+
+	min_note = min([tape.min_note for tape in group])
+	max_note = max([tape.max_note for tape in group])
+	metrics.count('labelled_slices', duration)
+
+	return BasisLabelling(group[0].tempo, note_data, basis_label, basis_prob, tension, marks, min_note, max_note)
+
+def label_roll(roll, metric = TensionModule.metric.dissonance, hard_limit = None, rollpath = None):
+	# label every tempo group of a roll: {tempo: BasisLabelling}
+	# rollpath: where the roll was read from, so its tapes are found next to it (see MusicRoll.tape_path)
 	tens_mod = TensionModule.TensionModule(metric)
+	return dict([(tempo, label_group(group, tens_mod, hard_limit)) for tempo, group in roll.get_tape_groups(rollpath = rollpath).items()])
 
-	for tempo, group in roll.get_tape_groups().items():
-		max_gap = 2 * max([tape.min_common for tape in group])
+def apply_labels(roll, labellings):
+	# attribute the bases to the roll (not its tapes): roll.basis maps tempo to the per-slice labels
+	roll.basis = dict([(tempo, labelling.basis_label[:,0].astype(np.int8)) for tempo, labelling in labellings.items()])
+	for label in roll.labels:
+		label.has_basis = label.tempo in roll.basis
+	return roll
 
-		note_data = MusicRoll.combine_notes(group)
+def label_file(filename, metric = TensionModule.metric.dissonance, hard_limit = None, write = True):
+	# label a pickled roll, and re-pickle it with its bases
+	roll = pickle.load(open(filename, 'rb'))
+	labellings = label_roll(roll, metric, hard_limit, filename)
+	if write:
+		apply_labels(roll, labellings)
+		pickle.dump(roll, open(filename, 'bw'))
+	return labellings
 
-		# Array - newness matters - simulate attentional decay
-		# @newness = 0 -> 1-k
-		# @newness = 1 -> 1
-		# factor = (1-k) + n * k
-		# 		 = 1 - k + nk = 1 - k * (n - 1)
-		orig_notes = note_data[...,0] * (1 - attn_decay * (note_data[...,1] - 1) )
+def render_basis_label(labelling, title = '', show = True, dtype = np.float64):
+	import matplotlib.pyplot as plt
+	from mpl_toolkits.axes_grid1 import AxesGrid
 
-		duration = min(np.size(orig_notes, 0), __hard_limit)
-		notes = ema(np.tile(orig_notes, 1), n_smoothing)[:duration]
+	duration = len(labelling.tension)
+	notes = labelling.notes(dtype) # float32 halves the plotted array, at no visible cost
 
-		# smoothing?
-		keys = np.r_[:np.size(notes, 1)]
+	fig1 = plt.figure(1, figsize = (5, 5))
+	
+	grid = AxesGrid(fig1, 111, 
+		nrows_ncols = (4, 1),
+		axes_pad = 0.05,
+		label_mode = "1",
+		)
 
-		fig1 = plt.figure(1, figsize = (5, 5))
-		
-		grid = AxesGrid(fig1, 111, 
-			nrows_ncols = (4, 1),
-			axes_pad = 0.05,
-			label_mode = "1",
-			)
-
-		Plot_Bases = grid[3]
-
-		basis_prob = np.zeros((duration, 12)) 	  # likelihoods
-		basis_label = np.zeros((duration, 1)) - 1 # labels
-		tension = np.zeros(duration)
-
-		def axis_basis(quanta):
-			actives = keys[quanta > 0.0001] + 3 # due to midi pitch nonsense - 0 is C
-			weights = quanta[quanta > 0.0001]
-			return tens_mod.basis_likelihood(np.vstack((actives, weights)).T)
-
-		def label(base, start, end):
-			if start == 0:
-				start -= 1
-			Plot_Bases.broken_barh([(start + 1, end - start - 1)], (base + 0.25 , 0.5), facecolors = 'red', alpha = 0.3, linewidth = 0)
-			basis_label[start + 1:end] = base
+	Plot_Bases = grid[3]
 
-		def bar(time):
+	for mark in labelling.marks:
+		if mark[0] == 'label':
+			(kind, base, start, end) = mark
+			Plot_Bases.broken_barh([(start + 1, end - start - 1)], (base + 0.25 , 0.5), facecolors = 'red', alpha = 0.3, linewidth = 0)
+		elif mark[0] == 'bar':
+			(kind, time) = mark
 			Plot_Bases.broken_barh([(time, 0.1)], (0, 12), facecolors = 'red', alpha = 0.7, linewidth = 0)
+		elif mark[0] == 'block' and __block:
+			(kind, base, start, end, color) = mark
+			Plot_Bases.broken_barh([(start + 1, end - start)], (base + 0.25, 0.5), facecolors = color, alpha = 1.0, linewidth = 0)
 
-		def block(base, start, end, color):
-			if __block:
-				Plot_Bases.broken_barh([(start + 1, end - start)], (base + 0.25, 0.5), facecolors = color, alpha = 1.0, linewidth = 0)
-			
-		# go through the time slices...
-		left = 0
-		right = 0
-		reach = 0
-		candidate = None
-		confidence = 0 # SHOULD BE USED
-
-		def notes_in_time(start, end):
-			return np.sum(note_data[start:end,:,1])
-
-		def label_basis():
-			if candidate == None:
-				for base in TensionModule.v_basis[b_curr == np.max(b_curr)]:
-					label(base, left - 1, right + 1)
-			else:
-				label(candidate, left - 1, right + 1)
-
-		def get_cand(notes):
-			# return (candidate, confidence)
-			return (trim(b_curr, b_ambiguous), np.max(b_curr))
-
-		while right < duration and right < __hard_limit:
-			# report
-			if right % __report_interval == 0:
-				print('{0}/{1}...'.format(right, duration))
-
-			# If we didn't have a candidate, try to check for one
-			if candidate == None:
-				# get current hypothesis from accumulated notes
-				confidence_factor = 1 - 1/(notes_in_time(left, right + 1) + 1)
-				section = np.sum(notes[left:right+1], 0)
-
-				b_curr = axis_basis(section) * confidence_factor
-
-				basis_prob[right] = b_curr
-				tension[right] = tens_mod.selfTension(section)
-
-				(try_cand, try_conf) = get_cand(b_curr)
-
-				# make sure there is only one candidate, and that it is confident enough
-				if np.sum(try_cand) == 1 and try_conf > thresh_conf:
-					# found a candidate
-					debug_print('got', right, try_cand, try_conf)
-					block(-0.5, right - 1, right, 'purple')
-					candidate = TensionModule.v_basis[try_cand > b_ambiguous][0]
-					confidence = try_conf
-				else:
-					# no candidate / still ambiguous
-					if np.sum(try_cand) > 1:
-						debug_print('non', right, 'multiple')
-					else:
-						debug_print('non', right, try_conf, '<', thresh_conf)
-					block(-0.5, right - 1, right, 'blue')
-			# If there is a candidate, check to see if the next observed slice follows
-			else:
-				reach = 0
-				similarity = -1
-
-				# attempt to bridge gap if dissimilarity is seen
-				while reach < max_gap and right + reach < duration and similarity < persistence:
-					# check if the following slice fits the hypothesis
-					# section = np.vstack((notes[left:right+1], notes[right + reach]))
-					# b_next = axis_basis(np.sum(section, 0))
-					b_next = axis_basis(notes[right + reach])
-					(try_cand, try_conf) = get_cand(b_next)
-
-					# similarity = matches(trim(b_curr, b_ambiguous, 1), b_next)
-					similarity = b_next[candidate]
-					debug_print('chk', right, right + reach, 'cnd', candidate, similarity)
-					reach += 1
-
-				# exited due to similarity - can extend
-				if similarity >= persistence or right + reach >= duration:
-					block(-0.5, right - 1, right, 'green')
-
-					debug_print('ext', right, similarity)
-					# all's right - we can aggregate this slice
-					section = np.sum(notes[left:right+1], 0)
-					# basis_prob[right] = b_curr = axis_basis(section)
-					basis_prob[right] = b_curr = axis_basis(notes[right])
-					tension[right] = tens_mod.selfTension(section)
-				# a gap was found and was too large
-				elif similarity < persistence and reach >= max_gap:
-					block(0, right - 1, right, 'yellow')
-					debug_print('rev', right, similarity, list(b_next))
-					bar(right)
-					right -= 1
-					label_basis()
-					candidate = None
-					left = right + 1
-
-			right += 1
-
-			# back-label
-
-		# label when hitting end
-		label_basis()
-
-		# basis_prob = np.apply_along_axis(axis_basis, 1, notes)
-		# ema(basis_prob, 0.2)
-
-		grid[0].set_title("{0} group {1}".format(roll.filepath, tempo))
-		
-		Plot_Bases.locator_params(axis='y', nbins = 12)
-
-		min_note = min([tape.min_note for tape in group])
-		max_note = max([tape.max_note for tape in group])
-
-		grid[0].plot(np.r_[:duration] + 0.5, 2 * tension / np.max(tension), 'k')
-		grid[1].imshow(notes.T[min_note:max_note + 1],
-			interpolation = 'none',
-			cmap = plt.cm.Oranges,
-			origin = 'lower',
-			extent=[0, duration, 0, 12],
-			aspect = 0.5 * duration / 24)
-		Plot_Bases.imshow(basis_prob.T,
-			interpolation = 'none', 
-			cmap = plt.cm.Greys,
-			origin = 'lower',
-			extent=[0, duration, 0, 12],
-			aspect = 0.5 * duration / 24)
-		grid[2].imshow(basis_label.T,
-			interpolation = 'none', 
-			cmap = plt.cm.jet,
-			origin = 'lower',
-			extent=[0, duration, 0, 12],
-			aspect = 0.5 * duration / (24 * 3))
-
-		# print(basis_label)
-
+	grid[0].set_title(title)
+	
+	Plot_Bases.locator_params(axis='y', nbins = 12)
+
+	grid[0].plot(np.r_[:duration] + 0.5, 2 * labelling.tension / np.max(labelling.tension), 'k')
+	grid[1].imshow(notes.T[labelling.min_note:labelling.max_note + 1],
+		interpolation = 'none',
+		cmap = plt.cm.Oranges,
+		origin = 'lower',
+		extent=[0, duration, 0, 12],
+		aspect = 0.5 * duration / 24)
+	Plot_Bases.imshow(labelling.basis_prob.T,
+		interpolation = 'none', 
+		cmap = plt.cm.Greys,
+		origin = 'lower',
+		extent=[0, duration, 0, 12],
+		aspect = 0.5 * duration / 24)
+	grid[2].imshow(labelling.basis_label.T,
+		interpolation = 'none', 
+		cmap = plt.cm.jet,
+		origin = 'lower',
+		extent=[0, duration, 0, 12],
+		aspect = 0.5 * duration / (24 * 3))
+
+	# print(basis_label)
+
+	if show:
 		plt.show()
+	return fig1
 
-		# TODO label afterwards, and re-pickle
+def do_basis_label(filename, metric = TensionModule.metric.dissonance):
+	# label and plot each tempo group of a roll, without writing anything
+	import pprint
+	pp = pprint.PrettyPrinter(indent=4)
+	roll = pickle.load(open(filename, 'rb'))
+	pp.pprint(vars(roll))
+
+	for tempo, labelling in label_roll(roll, metric, __hard_limit, filename).items():
+		render_basis_label(labelling, "{0} group {1}".format(roll.filepath, tempo))
 
 	# This is really a classification problem that ought to be addressed with the proper tools
 
@@ -271,6 +394,13 @@ def do_basis_label(filename, metric = TensionModule.metric.dissonance):
 # from pycallgraph.output import GraphvizOutput
 if __name__ == '__main__':
 	# with PyCallGraph(output=GraphvizOutput(output_file = "BASIS.png")):
+
+	# python midibasis.py --headless <roll.mrl> ... labels rolls in place, without plotting
+	if len(sys.argv) > 1 and sys.argv[1] == '--headless':
+		for filename in sys.argv[2:]:
+			for tempo, labelling in label_file(filename, TensionModule.metric.western).items():
+				print("'{0}' group {1}: {2} slices labelled".format(filename, tempo, np.sum(labelling.basis_label >= 0)))
+		sys.exit(0)
 	
 	# do_basis_label('./mid/bach/aof/can1.mrl', dissonance_metric)
 	do_basis_label('./mid/moldau_single.mrl', TensionModule.metric.western)
@@ -3,96 +3,132 @@
 # Parse MIDI. Different tempos necessitate different sections.
 
 import numpy as np
-from mido import MidiFile, MetaMessage
-from MusicRoll import *
-
+import metrics
+import midiparse
+from midiparse import META, SYSEX, SET_TEMPO, NOTE_ON, NOTE_OFF, PROGRAM_CHANGE, CONTROL_CHANGE, POLYTOUCH, AFTERTOUCH
+from MusicRoll import MusicTape, TAPE_VERSION
+
+# verbosity:
+#	0 - nothing
+#	1 - what happened to the file: tempo separation, unit lengths, unhandled events
+#	2 - per channel: note and event counts, length occurrences
+#	3 - every midi event, note and tape event
 verbosity = 0
 
-print_event = False
-show_note_events = False
-show_note_info = False
-show_raw_time_events = False
-show_onset_time_diffs = False
-show_full_length_occurrences = False
-show_normalized_events = False
-show_tape_data = False
+def report(level, *args):
+	if verbosity >= level:
+		print(*args)
 
 outlier_threshold = 0.001
 
+search_block = 256 # candidate rows per broadcast loss matrix, to bound its size
+
 class MidiNormalizer:
+	# midiFile: midiparse.MidiTracks (midiparse.read), or a mido MidiFile
 	def __init__(self, roll, midiFile):
 		self.roll = roll
+		if not isinstance(midiFile, midiparse.MidiTracks):
+			midiFile = midiparse.from_mido(midiFile)
 		self.midiFile = midiFile
 		self.time = 0
 		self.tempo = 500000
-		self.started = False
-		self.channels = {}
 		# channel lists grouped by tempo
 		self.final_channels = {}
 		# also grouped by tempo... a dictionary of dictionaries
 		self.fullen_dist = {}
 
 	# finalize channel
-	def channel_done(self, n, instrument = 0):
-		self.channels[n].cleanupTimes()
-		if not self.channels[n].convert_to_events():
-			del self.channels[n]
+	def channel_done(self, channel):
+		if not channel.convert_to_events():
 			return False
 		# TODO: Avoid note(s) from being divided by this function
 		# in the case that there is a tempo change in the middle of notes
-		
+
 		if self.tempo not in self.final_channels:
 			self.final_channels[self.tempo] = []
-		self.final_channels[self.tempo].append(self.channels[n])
-
-		# replace with new
-		self.channels[n] = ChannelNormalizer(self, n, self.time, instrument = instrument)
+		self.final_channels[self.tempo].append(channel)
 		return True
 
+	@metrics.timed('extract_events')
 	def extract_events(self):
-		for event in self.midiFile:
-			if print_event:
+		# split every channel into segments and pair their notes, on the columns of the merged events
+		# a segment ends when its channel changes instrument after playing, or at the end of the file;
+		# it joins the tempo group of the tempo in effect there
+		events = self.midiFile.merged()
+		metrics.count('midi_events', len(events))
+		if verbosity >= 3:
+			for event in midiparse.rows(events):
 				print(event)
-			# sec per beat = tempo / million
-			# sec per tick = sec per beat / ticks per beat
-			# ticks = time / sec per tick = time / (spb/tpb) = tpb * t / spb = tpb * t / (tmp / mill) = tpb * t * mill / tmp
-			self.time += round(event.time * float(self.midiFile.ticks_per_beat) * 1000000.0 / self.tempo)
-
-			if isinstance(event, MetaMessage):
-				if event.type == 'set_tempo':
-					self.tempo = event.tempo
-					# tempo change after file has already begun
-					if self.started:
-						print("Performing tempo separation")
-						for n, channel in self.channels.items():
-							self.channel_done(n)
-				elif event.type == 'end_of_track':
-					print("Total time:", self.time)
-					for n, channel in self.channels.items():
-						self.channel_done(n)
-			# have we seen this channel before?
-			else:
-				# channel 9 is always for percussion (in GM standard MIDI)
-				if event.type == 'sysex':
-					print("Unhandled sysex:",event)
-				elif event.channel != 9:
-					if event.channel not in self.channels:
-						self.channels[event.channel] = ChannelNormalizer(self, event.channel, self.time)
-					self.channels[event.channel].handle_event(event)
+		(time, kind, channel, data1) = (events['time'], events['kind'], events['channel'], events['data1'])
+
+		tempos = np.flatnonzero((kind == META) & (data1 == SET_TEMPO))
+		def tempo_at(i):
+			# tempo set by the events before event i
+			k = np.searchsorted(tempos, i) - 1
+			return int(events['value'][tempos[k]]) if k >= 0 else 500000
+
+		# channel 9 is always for percussion (in GM standard MIDI)
+		voice = (kind < SYSEX) & (channel != 9)
+		unhandled = (kind == SYSEX) | (voice & ((kind == POLYTOUCH) | (kind == AFTERTOUCH)))
+		if verbosity >= 1:
+			for event in midiparse.rows(events[unhandled]):
+				print("Unhandled event:", event)
+		metrics.count('unhandled_events', int(np.count_nonzero(unhandled)))
+
+		self.time = int(time[-1]) # of the end_of_track closing the merged events
+		report(1, "Total time:", self.time)
+
+		# (event ending it, order among those ending together, tempo, segment)
+		segments = []
+		for n in np.unique(channel[voice]).tolist():
+			indices = np.flatnonzero(voice & (channel == n))
+			(start, instrument, created) = (0, 0, indices[0])
+			for p in np.flatnonzero(kind[indices] == PROGRAM_CHANGE).tolist():
+				(i, program) = (indices[p], int(data1[indices[p]]))
+				if program == instrument:
+					continue
+				segment = events[indices[start:p]]
+				if not np.any((segment['kind'] == NOTE_ON) & (segment['data2'] > 0)):
+					instrument = program
+					report(2, "Channel ", n, "Instrument changed to ", program)
+					continue
+				report(1, "Channel {0} changed instrument to {1}".format(n, program))
+				notes = channel_notes(segment, int(time[i]))
+				segments.append((i, 0, tempo_at(i), ChannelNormalizer(self, n, notes, instrument)))
+				if len(notes):
+					(start, instrument) = (p + 1, program)
+				else:
+					# an empty channel is dropped - its next event starts it over, on the default instrument
+					(start, instrument) = (p + 1, 0)
+					created = indices[p + 1] if p + 1 < len(indices) else None
+			# at the end, channels finish in the order they were (last) started
+			if created is not None:
+				notes = channel_notes(events[indices[start:]], self.time)
+				segments.append((len(events), created, tempo_at(len(events)), ChannelNormalizer(self, n, notes, instrument)))
+
+		for (i, order, tempo, segment) in sorted(segments, key = lambda segment: segment[:2]):
+			self.tempo = tempo
+			self.channel_done(segment)
+		self.tempo = tempo_at(len(events))
 
 	# tempo is a global phenomenon - this takes care of inserting to dictionary
-	def count_full_length(self, length):
+	def count_full_length(self, length, occur = 1):
 		if self.tempo not in self.fullen_dist:
 			self.fullen_dist[self.tempo] = {}
 
 		if length in self.fullen_dist[self.tempo]:
-			self.fullen_dist[self.tempo][length] += 1
+			self.fullen_dist[self.tempo][length] += occur
 		else:
-			self.fullen_dist[self.tempo][length] = 1
+			self.fullen_dist[self.tempo][length] = occur
 
 	# Finish - perform normalization
-	def normalize(self, chop_loss_percent):
+	# search:
+	#	'refine' - start from the best of the shorter lengths and follow the largest error down
+	#	'exhaustive' - try every candidate up to the median length, taking the largest within the loss threshold
+	@metrics.timed('normalize')
+	def normalize(self, chop_loss_percent, search = 'refine'):
 		self.extract_events() # TODO - maybe bad practice to forcibly run this function here
+		units = self.compute_units(chop_loss_percent, search)
 
 		# get rid of empty channel recordings
 		for tempo, tempogroup in self.final_channels.items():
@@ -100,6 +136,17 @@ class MidiNormalizer:
 				if not channel.started:
 					tempogroup.remove(channel)
 
+		# adjust all channels in each tempo group
+		for tempo, tempogroup in self.final_channels.items():
+			(unit_len, mincommon) = units[tempo]
+			for channel in tempogroup:
+				channel.normalize_to_tape(unit_len, mincommon)
+
+	@metrics.timed('quantum_search')
+	def compute_units(self, chop_loss_percent, search = 'refine'):
+		# (unit length, minimum common length in units) for each tempo grouping
+		units = {}
+
 		# read in all full-length distributions for each tempo grouping
 		for tempo, tempogroup in self.final_channels.items():
 
@@ -109,12 +156,11 @@ class MidiNormalizer:
 
 			self.fullen_dist[tempo] = self.fullen_dist[tempo][self.fullen_dist[tempo][:,0].argsort()]
 
-			if show_full_length_occurrences:
-				print("Full Length Occurrences:")
-				print(self.fullen_dist[tempo])
+			report(2, "Full Length Occurrences:")
+			report(2, self.fullen_dist[tempo])
 
 			total_notes = np.sum(self.fullen_dist[tempo][:,1])
-			print("Total notes:", total_notes)
+			report(2, "Total notes:", total_notes)
 			
 			# find smallest of most common lengths
 			common = self.fullen_dist[tempo][self.fullen_dist[tempo][:,1].argsort(-1)][::-1]
@@ -126,60 +172,85 @@ class MidiNormalizer:
 			# TODO: Penalize excessively small intervals, such as "1" ?
 			i = median_index(self.fullen_dist[tempo][:,1], total_notes)
 
-			# second col will be replaced with loss
-			# third col will correspond to possible next candidate
-			candidates = np.c_[self.fullen_dist[tempo][:i], np.zeros(i).T.astype(int)]
-
-			# initial pass
-			# ensure there are no zero-length candidates, first
-			candidates = candidates[candidates[...,0] != 0]
-			next_r = self.best_candidate_mut(candidates, self.fullen_dist[tempo])
-			# cannibalize the candidates, begin refinement cycle
-			candidates = np.vstack((next_r[0], [next_r[0,2], 0, 0]))
-
 			loss = np.sum(self.fullen_dist[tempo][:,0]) # maximal
 			threshold = chop_loss_percent * loss # adjust? 0.5 percent loss permissible
-			converged = False
 
-			# refinement passes - TODO (fix hackneyed program flow)
-			while candidates[0,1] > threshold and np.all(candidates[...,0] > 0) and not converged:
-				# get loss values and potential next candidates
+			if search == 'exhaustive':
+				quantum = self.exhaustive_candidate(self.fullen_dist[tempo][:i,0], self.fullen_dist[tempo], threshold)
+			elif search == 'refine':
+				# second col will be replaced with loss
+				# third col will correspond to possible next candidate
+				candidates = np.c_[self.fullen_dist[tempo][:i], np.zeros(i).T.astype(int)]
+
+				# initial pass
+				# ensure there are no zero-length candidates, first
+				candidates = candidates[candidates[...,0] != 0]
 				next_r = self.best_candidate_mut(candidates, self.fullen_dist[tempo])
-				converged = candidates[1,1] >= candidates[0,1] 			 # did the loss actually get worse?
-				candidates = np.vstack((next_r[0], [next_r[0,2], 0, 0])) # set up check for potential next candidate
+				# cannibalize the candidates, begin refinement cycle
+				candidates = np.vstack((next_r[0], [next_r[0,2], 0, 0]))
+
+				converged = False
+
+				# refinement passes - TODO (fix hackneyed program flow)
+				while candidates[0,1] > threshold and np.all(candidates[...,0] > 0) and not converged:
+					# get loss values and potential next candidates
+					next_r = self.best_candidate_mut(candidates, self.fullen_dist[tempo])
+					converged = candidates[1,1] >= candidates[0,1] 			 # did the loss actually get worse?
+					candidates = np.vstack((next_r[0], [next_r[0,2], 0, 0])) # set up check for potential next candidate
+				quantum = candidates[0,0]
+			else:
+				raise ValueError("Unknown quantum search '{0}'".format(search))
 
 			# candidates have been obtained
 			# unit length should be halved to distinguish sequential notes from sustained notes
 			# (allow note decay)
-			unit_len = candidates[0,0] // 2
+			unit_len = quantum // 2
+			if unit_len < 1:
+				raise ValueError("Quantum of tempo group {0} is {1} ticks - too short for a unit length".format(tempo, quantum))
 			# express minimum common length in terms of unit_length
 			mincommon //= unit_len
 
-			print("Unit length for tempo group {0} is {1},\n\t with {2} times unit_len being most common".format(tempo, unit_len, mincommon))
-
-			# adjust all channels in the tempo group
-			for channel in tempogroup:
-				channel.normalize_to_tape(unit_len, mincommon)
+			report(1, "Unit length for tempo group {0} is {1},\n\t with {2} times unit_len being most common".format(tempo, unit_len, mincommon))
+			units[tempo] = (unit_len, mincommon)
+			metrics.count('tempo_groups')
+		return units
 
 	# also a mutating operation
 	def best_candidate_mut(self, candidates, full_lengths):
 		# return best candidate, writing in loss into input array of candidates
-		for candidate_row in candidates:
-			if candidate_row[0] == 0:
-				print("Zero candidate!!", candidates)
+		if np.any(candidates[:,0] == 0):
+			report(1, "Zero candidate!!", candidates)
 
-			# closest multiple, error weighted by note length occurence frequency
-			adjusted = np.round(full_lengths[:,0] / candidate_row[0])
-			
-			# adjusted values do not go to zero - not here, anyway
-			adjusted[adjusted == 0] += 1
+		(candidates[:,1], candidates[:,2]) = quantize_loss(candidates[:,0], full_lengths)
+		return candidates[np.min(candidates[:,1])==candidates[:,1]]
 
-			diffs = (full_lengths[:,0] - candidate_row[0] * adjusted).astype(int)
-			candidate_row[2] = np.max(np.abs(diffs))
+	def exhaustive_candidate(self, lengths, full_lengths, threshold):
+		# try every length from 2 up to the longest candidate
+		# (loss is far from unimodal in the length - no bracketing search can be trusted)
+		quanta = np.r_[2:max(np.max(lengths), 2) + 1]
+		losses = np.zeros(len(quanta), dtype = int)
+		for start in np.r_[0:len(quanta):search_block]:
+			losses[start:start + search_block] = quantize_loss(quanta[start:start + search_block], full_lengths)[0]
 
-			# loss
-			candidate_row[1] = np.sum(np.abs(diffs) * full_lengths[:,1])
-		return candidates[np.min(candidates[:,1])==candidates[:,1]]
+		# smaller quanta always lose less - measure loss beyond the least loss per unit of length,
+		# and take the largest quantum within threshold of it
+		least = np.argmin(losses / quanta)
+		excess = losses * quanta[least] - quanta * losses[least] # (in ints, so the least itself is always within)
+		return quanta[excess <= threshold * quanta[least]][-1]
+
+def quantize_loss(quanta, full_lengths):
+	# (loss, largest error) of rounding every full length to a multiple of each quantum
+	# one candidate per row of a (candidates x lengths) matrix
+	lengths = full_lengths[:,0]
+
+	# closest multiple, error weighted by note length occurence frequency
+	adjusted = np.round(lengths / quanta[:,np.newaxis])
+
+	# adjusted values do not go to zero - not here, anyway
+	adjusted[adjusted == 0] += 1
+
+	diffs = np.abs((lengths - quanta[:,np.newaxis] * adjusted).astype(int))
+	return (diffs @ full_lengths[:,1], np.max(diffs, 1))
 
 def median_index(array, maxm):
 	i = 0
@@ -189,134 +260,117 @@ def median_index(array, maxm):
 		i += 1
 	return i
 
+def control_level(events, control):
+	# value / 127 of the latest change of a control at every event (1 before any)
+	changes = (events['kind'] == CONTROL_CHANGE) & (events['data1'] == control)
+	latest = np.maximum.accumulate(np.where(changes, np.arange(len(events)), -1))
+	return np.where(latest >= 0, events['data2'][latest] / 127.0, 1.0)
+
+def channel_notes(events, end_time):
+	# finished notes of a channel segment (its events, in order) as rows of
+	# (note, start, length, velocity, full length), in the order they finish:
+	# a released note finishes at the next note on (of any note), or at end_time - its full length runs to there,
+	# its length to its last release before then; notes struck again while held, or held at the end, are lost
+	(time, kind, pitch, data2) = (events['time'], events['kind'], events['data1'].astype(np.int64), events['data2'])
+	on = np.flatnonzero((kind == NOTE_ON) & (data2 > 0))
+	off = np.flatnonzero((kind == NOTE_OFF) | ((kind == NOTE_ON) & (data2 == 0)))
+	if len(on) == 0 or len(off) == 0:
+		return np.zeros((0, 5), dtype = np.int64)
+
+	# events of each note together, in order: note * span + position
+	span = len(events) + 1
+	on_keys = pitch[on] * span + on
+	strikes = np.sort(on_keys)
+	releases = np.sort(pitch[off] * span + off)
+
+	# the next release and the next strike of the same note
+	r = np.minimum(np.searchsorted(releases, on_keys), len(releases) - 1)
+	released = releases[r] // span == pitch[on]
+	released &= releases[r] > on_keys
+	s = np.minimum(np.searchsorted(strikes, on_keys, 'right'), len(strikes) - 1)
+	struck = (strikes[s] // span == pitch[on]) & (strikes[s] > on_keys)
+	finished = released & ~(struck & (strikes[s] < releases[r]))
+
+	# a note keeps the place (among notes finishing together) of the first of the strikes
+	# before it that were each cut short by the next
+	order = np.argsort(on_keys)
+	first = np.r_[True, (pitch[on][order][1:] != pitch[on][order][:-1]) | finished[order][:-1]]
+	place = np.empty(len(on), dtype = np.int64)
+	place[order] = on[order][np.maximum.accumulate(np.where(first, np.arange(len(on)), 0))]
+
+	velocity = np.round(data2[on] * control_level(events, 7)[on] * control_level(events, 11)[on]).astype(np.int64)
+
+	done = np.flatnonzero(finished)
+	f = np.searchsorted(on, releases[r[done]] % span, 'right')
+	finish = np.r_[on, len(events)][f]
+	finish_time = np.r_[time[on], end_time][f]
+	last = releases[np.searchsorted(releases, pitch[on[done]] * span + finish) - 1] % span
+
+	rank = np.lexsort((place[done], finish))
+	starts = time[on[done]]
+	notes = np.c_[pitch[on[done]], starts, time[last] - starts, velocity[done], finish_time - starts]
+	return notes[rank]
+
 class ChannelNormalizer:
-	def __init__(self, owner, num, start_time, instrument = 0):
+	# one channel between instrument changes, with its finished notes (rows of channel_notes)
+	def __init__(self, owner, num, notes, instrument = 0):
 		self.num = num
-		self.started = False
 		self.owner = owner
 		self.instrument = instrument # piano - default
-		self.activeNotes = {}
-		self.noteLengths = []
-		self.events = []
-		self.start_time = start_time
-		self.volume = [1.000, 1.000] # one for volume, one for expression
-
-	def cleanupTimes(self, delete = True):
-		toDelete = []
-		for key, note in self.activeNotes.items():
-			if note[0] is False:
-				note[3] = self.owner.time - note[1]
-										#  key  start    notetime velocity fulltime      downtime
-				self.noteLengths.append( ( key, note[1], note[2], note[4], note[3], note[3] - note[2]) )
-				toDelete.append(key)
-		if delete:
-			for note in toDelete:
-				del self.activeNotes[note]
-
-	def noteOn(self, event):
-		if show_note_events:
-			print(event)
-		# initial activation
-		# flag, activation tick, on-off duration tick, on-off-next_on tick, discretized velocity
-		self.cleanupTimes() # clear downtimes for ready notes
-		self.activeNotes[event.note] = [True, self.owner.time, 0, 0, round(event.velocity * self.volume[0] * self.volume[1])]
-		# self.cleanupTimes() # clear downtimes for ready notes
-		# boolean is a 'downtime flag': true if note was just turned on, false if off but next note not fired (downtime)
-
-	def noteOff(self, event):
-		if show_note_events:
-			print(event)
-		if event.note in self.activeNotes:
-			self.activeNotes[event.note][0] = False
-			self.activeNotes[event.note][2] = self.owner.time - self.activeNotes[event.note][1] # length from on to off
-
-	def handle_event(self, event):
-		# handle an event
-		if event.type == 'note_on':
-			if event.velocity > 0:
-				self.started = True
-				self.noteOn(event)
-			else:
-				self.noteOff(event)
-		elif event.type == 'note_off':
-			self.noteOff(event)
-		# TODO may be an instrument change
-		elif event.type == 'program_change':
-			if event.program != self.instrument:
-				if self.started:
-					# self.owner.final_channels[self.owner.tempo].append(self)
-					print("Channel {0} changed instrument to {1}".format(self.num, event.program))
-					self.owner.channel_done(self.num, instrument = event.program)
-				else:
-					self.instrument = event.program
-					print("Channel ", event.channel, "Instrument changed to ", event.program)
-		elif event.type == 'pitchwheel':
-			pass # TODO
-			# in honesty, this should probably be ignored
-			# as we want to consider "music" and not "effects"
-		elif event.type == 'control_change':
-			if event.control == 7: # track volume
-				self.volume[0] = event.value / 127.0
-			elif event.control == 11: # track expression - percentage of volume
-				self.volume[1] = event.value / 127.0
-			elif event.control == 120 or event.control == 123:
-				pass # TODO all notes off
-			# all controls reset - also should affect pitchwheel
-		else:
-			print("Warning: Type not covered:", event)
-			
-	def convert_to_events(self):
-		# Convert note history to event list
-		print("## ## ## Channel", self.num)
+		self.notes = notes
+		self.started = len(notes) > 0
+		self.events = None
+		self.start_time = None
 
-		lens = np.array(self.noteLengths).astype(float)
+	@metrics.timed('convert_to_events')
+	def convert_to_events(self):
+		# Convert note history to event columns
+		report(2, "## ## ## Channel", self.num)
 
-		if np.size(lens) is 0:
-			print("Empty channel!")
+		lens = self.notes
+		if len(lens) == 0:
+			report(2, "Empty channel!")
 			return False
-		
-		if show_note_info:
+		metrics.count('channels')
+		metrics.count('notes', len(lens))
+
+		if verbosity >= 3:
 			print("lengths:\n\t[NOTE ON_TIME NOTE_DURATION VELOCITY FULLTIME DOWNTIME]")
-			for row in lens.astype(int):
+			for row in np.c_[lens, lens[:,4] - lens[:,2]]:
 				print('\t{}'.format(row))
 
-		if show_onset_time_diffs:
 			print("Time diffs between onsets:")
-			print(np.diff(lens.astype(int)[:,1]))
+			print(np.diff(lens[:,1]))
 
 		# normalize note times and on-times by dividing over (minimum of full / round (full / note) )
-		for full_length in lens[:-1,4]:
-			self.owner.count_full_length(full_length)
-		
-		# normalize, convert to tuples of (NOTE, ON_TIME, DURATION, VELOCITY)
-		lens = lens.astype(int)[:,0:4]
-
-		# Change values to event values
-		events = np.tile(lens[:,0], (4, 2)).T # NOTE by default
-		events[:len(lens), 0] = lens[:,1] # note on time
-		events[len(lens):, 0] = lens[:,1] + lens[:,2]
-		events[:len(lens), 1] = MusicTape.NOTE_ON
-		events[len(lens):, 1] = MusicTape.NOTE_OFF
-		events[:len(lens), 3] = lens[:,3] # note on velocities
-		events[len(lens):, 3] = 0 # note off velocities
+		# (the last note's full length only runs to the end of the channel)
+		(full_lengths, occurs) = np.unique(lens[:-1,4], return_counts = True)
+		for full_length, occur in zip(full_lengths.tolist(), occurs.tolist()):
+			self.owner.count_full_length(full_length, occur)
+
+		# (TIME, ON/OFF, NOTE, VELOCITY) columns of note on and off events
+		times = np.r_[lens[:,1], lens[:,1] + lens[:,2]]
+		types = np.repeat([MusicTape.NOTE_ON, MusicTape.NOTE_OFF], len(lens))
+		notes = np.r_[lens[:,0], lens[:,0]]
+		velocities = np.r_[lens[:,3], np.zeros(len(lens), dtype = lens.dtype)]
 
 		# make sure on is before off, then sort by on-time
-		events = events[np.lexsort((events[:,1], events[:,0]))]
-		if show_raw_time_events:
+		order = np.lexsort((types, times))
+		self.events = (times[order], types[order], notes[order], velocities[order])
+		if verbosity >= 3:
 			print("Raw-time events:")
 			print("\t[TIME ON/OFF NOTE VELOCITY]")
-			for event in events:
+			for event in zip(*self.events):
 				print('\t', event)
-
-		self.events = events
 		return True
 
+	@metrics.timed('normalize_to_tape')
 	def normalize_to_tape(self, unit_len, min_common):
 		# normalize event times
-		events = self.events
-		events[:, 0] = np.round(events[:, 0] / unit_len)
-		self.start_time = np.min(events[:, 0])# time of first event onset
-		
+		(times, types, notes, velocities) = self.events
+		times = np.round(times / unit_len).astype(times.dtype)
+		self.start_time = np.min(times) # time of first event onset
+
 		# Separate time and note events for easy processing
 		tape = self.owner.roll.appendAbsoluteTape(
 			self.start_time,
@@ -326,29 +380,25 @@ class ChannelNormalizer:
 			unit_len,
 			min_common) # note count
 
-		print("Event count:", np.size(events, 0))
+		report(2, "Event count:", len(times))
+		metrics.count('tape_events', len(times))
 
-		if show_normalized_events:
+		if verbosity >= 3:
 			print("Events:")
-			for event in events:
+			for event in zip(times, types, notes, velocities):
 				print(event)
 
 		# begins at first note. start_time informs this
-		tick = self.start_time
-		for i in range(0, events.shape[0]):
-			if events[i][0] > tick:
-				# tape.addTimeEvent(events[i][0] - tick, tick)
-				# NO TIME EVENTS - too much of a hassle
-				tick = events[i][0]
-			tape.addNoteEvent(events[i][1], events[i][2], events[i][3], tick)
-
-		if show_tape_data:
+		# events are sorted, so their times are already the ticks they sound at
+		# NO TIME EVENTS - too much of a hassle
+		tape.add_events(times, types, notes, velocities)
+
+		if verbosity >= 3:
 			print("Tape data:")
-			for event in tape.data:
+			for event in zip(*tape.unpack_data()):
 				print(event)
-		
-		print("Finished channel", self.num)
-		tape.finalize()
+
+		report(2, "Finished channel", self.num)
 
 """
 Possible issues:
@@ -356,13 +406,19 @@ Possible issues:
 """
 
 import hashlib
+import MusicRoll as roll_module
 
-def md5():
+def md5(filename = __file__):
     hash_md5 = hashlib.md5()
-    with open('midinormalizer.py', "rb") as f:
+    with open(filename, "rb") as f:
         for chunk in iter(lambda: f.read(4096), b""):
             hash_md5.update(chunk)
     return str(hash_md5.hexdigest())
 
+def code_version():
+	# everything that decides what normalization writes: this module, the midi reader, the roll/tape code and the tape format
+	return '{0}-{1}-{2}-v{3}'.format(md5(__file__), md5(midiparse.__file__), md5(roll_module.__file__), TAPE_VERSION)
+
 if __name__ == '__main__':
-	print(md5())
\ No newline at end of file
+	print(md5())
+	print(code_version())
\ No newline at end of file
@@ -0,0 +1,210 @@
+# Direct reader of standard MIDI files
+# MTrk chunks are scanned straight from the file's bytes into numpy columns of absolute-tick events,
+# one array per track; merged() interleaves the tracks in playback order (as mido iterates a file),
+# without building a python object per message or converting ticks to seconds and back.
+#
+#	events = midiparse.read(path).merged()
+#	events['time'], events['kind'], events['channel'], events['data1'], ...
+
+import struct
+import heapq
+import numpy as np
+from array import array
+
+# event kinds - the status byte without its channel, except for sysex and meta
+NOTE_OFF = 0x80
+NOTE_ON = 0x90
+POLYTOUCH = 0xA0
+CONTROL_CHANGE = 0xB0
+PROGRAM_CHANGE = 0xC0
+AFTERTOUCH = 0xD0
+PITCHWHEEL = 0xE0
+SYSEX = 0xF0 # also escapes and system common messages - none are handled
+META = 0xFF
+
+# meta types (in data1 of a META event)
+SET_TEMPO = 0x51
+END_OF_TRACK = 0x2F
+
+# data1, data2:
+#	notes - note, velocity; control change - control, value; program change - program;
+#	aftertouch - pressure; meta - meta type
+# value: pitch of pitchwheel (-8192 to 8191), tempo of set_tempo
+EVENT = np.dtype([
+	('time', np.int64), # absolute ticks
+	('kind', np.uint8),
+	('channel', np.uint8),
+	('data1', np.uint8),
+	('data2', np.uint8),
+	('value', np.int32),
+	])
+
+HEADER = struct.Struct('>4sIHHH') # MThd, length, format, tracks, division
+CHUNK = struct.Struct('>4sI')
+
+DATA_BYTES = {NOTE_OFF: 2, NOTE_ON: 2, POLYTOUCH: 2, CONTROL_CHANGE: 2, PROGRAM_CHANGE: 1, AFTERTOUCH: 1, PITCHWHEEL: 2}
+COMMON_BYTES = {0xF1: 1, 0xF2: 2, 0xF3: 1} # system common messages, other than sysex
+
+class MidiTracks:
+	def __init__(self, ticks_per_beat, tracks, format = 1, filename = None):
+		self.ticks_per_beat = ticks_per_beat
+		self.tracks = tracks # EVENT arrays
+		self.format = format
+		self.filename = filename
+
+	def __len__(self):
+		return sum([len(track) for track in self.tracks])
+
+	def merged(self):
+		return merge_tracks(self.tracks)
+
+def read(filename):
+	with open(filename, 'rb') as f:
+		midi = parse(f.read())
+	midi.filename = filename
+	return midi
+
+def parse(data):
+	(name, length, format, count, division) = HEADER.unpack_from(data, 0)
+	if name != b'MThd':
+		raise ValueError("Not a MIDI file (no MThd header)")
+
+	tracks = []
+	i = 8 + length
+	while i + CHUNK.size <= len(data):
+		(name, length) = CHUNK.unpack_from(data, i)
+		i += CHUNK.size
+		if name == b'MTrk': # other chunks are skipped
+			tracks.append(read_track(data, i, min(i + length, len(data))))
+		i += length
+	return MidiTracks(division, tracks, format)
+
+def read_track(data, i, end):
+	# scan the events of one MTrk chunk occupying data[i:end]
+	times = array('q')
+	kinds = array('B')
+	channels = array('B')
+	data1 = array('B')
+	data2 = array('B')
+	values = array('q')
+
+	time = 0
+	running = None
+	while i < end:
+		# delta time, a variable length quantity
+		byte = data[i]
+		i += 1
+		delta = byte & 0x7F
+		while byte & 0x80:
+			byte = data[i]
+			i += 1
+			delta = (delta << 7) | (byte & 0x7F)
+		time += delta
+
+		status = data[i]
+		if status & 0x80:
+			i += 1
+			if status < 0xF0:
+				running = status
+		elif running is None:
+			raise ValueError("Running status without a previous status byte")
+		else:
+			status = running # first data byte is not consumed
+
+		(kind, channel, a, b, value) = (status & 0xF0, status & 0x0F, 0, 0, 0)
+		if status < 0xF0:
+			a = data[i]
+			if DATA_BYTES[kind] == 2:
+				b = data[i + 1]
+			i += DATA_BYTES[kind]
+			if kind == PITCHWHEEL:
+				value = ((b << 7) | a) - 8192
+		elif status == META or status == 0xF0 or status == 0xF7:
+			if status == META:
+				(kind, channel, a) = (META, 0, data[i])
+				i += 1
+			else:
+				(kind, channel) = (SYSEX, 0)
+			length = 0
+			byte = 0x80
+			while byte & 0x80:
+				byte = data[i]
+				i += 1
+				length = (length << 7) | (byte & 0x7F)
+			if kind == META and a == SET_TEMPO:
+				value = int.from_bytes(data[i:i + 3], 'big')
+			i += length
+		else:
+			(kind, channel) = (SYSEX, 0)
+			i += COMMON_BYTES.get(status, 0)
+
+		times.append(time)
+		kinds.append(kind)
+		channels.append(channel)
+		data1.append(a)
+		data2.append(b)
+		values.append(value)
+
+	track = np.zeros(len(times), dtype = EVENT)
+	for field, column in zip(EVENT.names, (times, kinds, channels, data1, data2, values)):
+		track[field] = np.frombuffer(column, dtype = column.typecode)
+	return track
+
+def merge_tracks(tracks):
+	# k-way merge by time - ties go to the earlier track, as mido merges them
+	# a heap holds the next event of every track; whole runs of a track are taken at once
+	# end_of_track events are dropped, and one put after the last event of any track
+	ends = [track for track in tracks if len(track)]
+	end = max([track['time'][-1] for track in ends]) if ends else 0
+	tracks = [track[(track['kind'] != META) | (track['data1'] != END_OF_TRACK)] for track in tracks]
+
+	merged = np.zeros(sum([len(track) for track in tracks]) + 1, dtype = EVENT)
+	at = 0
+	heap = [(track['time'][0], n, 0) for n, track in enumerate(tracks) if len(track)]
+	heapq.heapify(heap)
+	while heap:
+		(time, n, start) = heapq.heappop(heap)
+		times = tracks[n]['time']
+		if heap:
+			# up to the next event of another track (through it, if that track comes later)
+			(next_time, m, _) = heap[0]
+			stop = start + np.searchsorted(times[start:], next_time, side = 'right' if n < m else 'left')
+		else:
+			stop = len(times)
+		merged[at:at + stop - start] = tracks[n][start:stop]
+		at += stop - start
+		if stop < len(times):
+			heapq.heappush(heap, (times[stop], n, stop))
+
+	merged[at] = (end, META, 0, END_OF_TRACK, 0, 0)
+	return merged
+
+def rows(events):
+	# (time, kind, channel, data1, data2, value) tuples of python ints - for printing and debugging
+	return zip(*[events[field].tolist() for field in EVENT.names])
+
+def from_mido(midi):
+	# the same arrays from a mido MidiFile - its tracks keep delta ticks, so no times are converted
+	tracks = []
+	for track in midi.tracks:
+		events = np.zeros(len(track), dtype = EVENT)
+		for n, message in enumerate(track):
+			(kind, channel, a, b, value) = (SYSEX, 0, 0, 0, 0)
+			if message.is_meta:
+				(kind, a) = (META, message.bytes()[1])
+				if message.type == 'set_tempo':
+					value = message.tempo
+			elif message.type != 'sysex':
+				status = message.bytes()
+				(kind, channel) = (status[0] & 0xF0, status[0] & 0x0F)
+				if kind in DATA_BYTES:
+					a = status[1]
+					b = status[2] if len(status) > 2 else 0
+					if kind == PITCHWHEEL:
+						value = message.pitch
+				else:
+					(kind, channel) = (SYSEX, 0)
+			events[n] = (message.time, kind, channel, a, b, value)
+		events['time'] = np.cumsum(events['time'])
+		tracks.append(events)
+	return MidiTracks(midi.ticks_per_beat, tracks, midi.type, midi.filename)
@@ -0,0 +1,13 @@
+import os
+import sys
+from MusicRoll import migrate_roll
+
+# rewrite the pickled (version 1) tapes of every roll under a folder in the columnar format
+# rolls are read as-is either way - this only saves the conversion on every load
+if __name__ == "__main__":
+	folder = sys.argv[1] if len(sys.argv) > 1 else '.'
+	for root, dirs, files in os.walk(folder):
+		for file in files:
+			if file.endswith(".mrl"):
+				print("Migrating '{0}'".format(os.path.join(root, file)))
+				migrate_roll(os.path.join(root, file))
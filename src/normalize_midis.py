@@ -1,39 +1,136 @@
 import os
+import io
+import sys
+import argparse
+import traceback
+import contextlib
+import json
+import multiprocessing
+import metrics
+import midiparse
 import midinormalizer
-from mido import MidiFile, MetaMessage
-from MusicRoll import *
+from buildcache import BuildManifest, build_key
+from MusicRoll import MusicRoll
 
 def iter_midis_in_path(folder_path):
+	# sorted, so that runs visit (and report) files in the same order
 	for root, dirs, files in os.walk(folder_path):
-		for file in files:
+		dirs.sort()
+		for file in sorted(files):
 			if file.endswith(".mid") or file.endswith(".MID"):
 				 yield (os.path.join(root, file), file)
 
-def perform(path):
+def perform(path, chop_loss_percent = 0.002, search = 'refine'): # 0.2 percent
+	# normalize one file, returning the files written
 	print("Processing '{0}'".format(path))
 	roll = MusicRoll(path, labels = [], tapes = [])
-	midi = MidiFile(path)
-	midinormalizer.MidiNormalizer(roll, midi).normalize(chop_loss_percent = 0.002) # 0.2 percent
-	roll.set_hash(midinormalizer.md5())
+	midi = midiparse.read(path)
+	midinormalizer.MidiNormalizer(roll, midi).normalize(chop_loss_percent = chop_loss_percent, search = search)
+	roll.set_hash(midinormalizer.md5(midinormalizer.__file__))
 	roll.dump(self_contained = False)
+	return [roll.filepath] + [label.filename for label in roll.labels]
+
+def perform_captured(job):
+	# run perform, keeping its output and any failure instead of letting them escape
+	# (workers would otherwise interleave their output, and one bad file would end the run)
+	# options: verbosity of the normalizer, whether to collect metrics, and a folder for profiles
+	path, params, options = job
+	midinormalizer.verbosity = options.get('verbosity', 0)
+	profile = options.get('profile')
+	if profile is not None:
+		profile = os.path.join(profile, os.path.basename(path) + '.prof')
+
+	log = io.StringIO()
+	outputs = None
+	error = None
+	with contextlib.redirect_stdout(log), metrics.profile(profile), metrics.record(path, options.get('metrics', False)) as record:
+		try:
+			outputs = perform(path, **params)
+		except Exception:
+			error = traceback.format_exc()
+	return (path, log.getvalue(), outputs, error, record.to_json())
+
+def perform_all(paths, params = {}, workers = 1, verbose = True, options = {}):
+	# normalize files, in a process pool if workers > 1
+	# yields (path, outputs, traceback, metrics) as files finish, in input order
+	jobs = [(path, params, options) for path in paths]
+	pool = None
+	if workers > 1:
+		pool = multiprocessing.Pool(workers)
+		results = pool.imap(perform_captured, jobs) # in order, as soon as each is ready
+	else:
+		results = map(perform_captured, jobs)
+
+	try:
+		for done, (path, log, outputs, error, file_metrics) in enumerate(results, 1):
+			if verbose:
+				print(log, end = '')
+			print("[{0}/{1}] {2} '{3}'".format(done, len(paths), "Failed" if error else "Done", path))
+			yield (path, outputs, error, metrics.Metrics.from_json(file_metrics))
+	finally:
+		if pool is not None:
+			pool.close()
+			pool.join()
 
 # from pycallgraph import PyCallGraph
 # from pycallgraph.output import GraphvizOutput
 if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description = "Normalize every MIDI file under a folder into music rolls.")
+	parser.add_argument('folder', nargs = '?', default = '.')
+	parser.add_argument('-j', '--workers', type = int, default = 1, help = "worker processes (0 for one per core)")
+	parser.add_argument('-q', '--quiet', action = 'store_true', help = "only report progress and failures")
+	parser.add_argument('-f', '--force', action = 'store_true', help = "rebuild everything, ignoring the manifest")
+	parser.add_argument('--chop-loss', type = float, default = 0.002, help = "permissible quantization loss (fraction)")
+	parser.add_argument('--search', choices = ['refine', 'exhaustive'], default = 'refine', help = "how the quantization unit is searched for")
+	parser.add_argument('-v', '--verbose', action = 'count', default = 0, help = "normalizer output: -v per file, -vv per channel, -vvv per event")
+	parser.add_argument('--metrics', help = "save per-file timers and counters (and their totals) to this json file")
+	parser.add_argument('--profile', help = "save a cProfile of every file into this folder")
+	args = parser.parse_args()
+
 	# with PyCallGraph(output=GraphvizOutput()):
-	for path, file in iter_midis_in_path('.'):
+	# outputs are rebuilt when the midi file, the normalizer code or the parameters change
+	manifest = BuildManifest(args.folder)
+	version = midinormalizer.code_version()
+	params = {'chop_loss_percent': args.chop_loss, 'search': args.search}
 
-		roll_name = path[:-4] + '.mrl'
-		# no music roll file?
-		if not os.path.isfile(roll_name):
-			perform(path)
+	jobs = {}
+	skipped = 0
+	for path, file in iter_midis_in_path(args.folder):
+		content = manifest.content_hash(path)
+		key = build_key(content, version, params)
+		if args.force or not manifest.is_current(path, key):
+			jobs[path] = (content, key)
 		else:
-			# file is outdated?
-			old_roll = pickle.load(open(roll_name, 'rb'))
-			if not (hasattr(old_roll, 'md5') and old_roll.md5 == midinormalizer.md5()):
-				perform(path)
-			else:
+			skipped += 1
+			if not args.quiet:
 				print("Skipping '{0}'".format(file))
 
+	workers = args.workers if args.workers > 0 else multiprocessing.cpu_count()
+	options = {'verbosity': args.verbose, 'metrics': args.metrics is not None, 'profile': args.profile}
+	if args.profile is not None:
+		os.makedirs(args.profile, exist_ok = True)
+
+	failures = []
+	file_metrics = []
+	total = metrics.Metrics('total')
+	try:
+		for path, outputs, error, record in perform_all(list(jobs), params, workers, not args.quiet, options):
+			file_metrics.append(record.to_json())
+			total.merge(record)
+			if error is None:
+				manifest.record(path, jobs[path][0], jobs[path][1], outputs)
+			else:
+				manifest.forget(path)
+				failures.append((path, error))
+	finally:
+		manifest.save()
 
+	print("Normalized {0}, skipped {1}, failed {2}".format(len(jobs) - len(failures), skipped, len(failures)))
+	if args.metrics is not None:
+		print(total.report())
+		with open(args.metrics, 'w') as f:
+			json.dump({'total': total.to_json(), 'files': file_metrics}, f, indent = 1)
+	for path, error in failures:
+		print("\n'{0}':\n{1}".format(path, error), end = '')
 
+	sys.exit(1 if failures else 0)
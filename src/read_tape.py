@@ -1,10 +1,11 @@
-from MusicRoll import *
+import pickle
+import numpy as np
 
 roll = pickle.load(open('./mid/channel_sep.mrl', 'rb'))
 
 for tempo, group in roll.get_tape_groups().items():
-	notes = roll.combine_notes(group)[...,0]
-	keys = np.r_[:np.size(notes, 1)]
-	for row in notes:
-		print(keys[row != 0])
+	# one pass over the dense held velocities, rather than a scan of every interval per slice
+	held = roll.combine_intervals(group).to_dense()[:, :, 0]
+	for row in held:
+		print(np.flatnonzero(row > 0))
 	
\ No newline at end of file
@@ -0,0 +1,139 @@
+# Single-file archive of normalized music rolls (.mra)
+# One header, every tape stored back to back in the columnar tape format,
+# and a json index at the end mapping midi paths to roll labels and tape offsets.
+
+import os
+import sys
+import json
+import pickle
+import struct
+import numpy as np
+from MusicRoll import MusicRoll, MusicTape, TapeLabel, load_tape, tape_path
+
+ARCHIVE_MAGIC = b'MRLA'
+ARCHIVE_VERSION = 1
+ARCHIVE_HEADER = struct.Struct('<4sHxxQQ') # magic, version, index offset, index size
+
+LABEL_FIELDS = ['index', 'time', 'tempo', 'has_basis', 'channel', 'unit', 'min_common']
+
+def archive_key(midipath):
+	# rolls are looked up by midi path, whichever separators it was written with
+	return os.path.normpath(midipath.replace('\\', '/'))
+
+def roll_tapes(roll, rollpath = None):
+	# the tapes of a roll, in label order
+	if getattr(roll, 'self_contained', True):
+		return [roll.tapes[label.index] for label in roll.labels]
+
+	return [load_tape(tape_path(label, rollpath), mmap = False) for label in roll.labels]
+
+class RollArchiveWriter:
+	def __init__(self, filename):
+		self.filename = filename
+		self.file = open(filename, 'wb')
+		self.file.write(ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, 0, 0))
+		self.rolls = []
+
+	def add(self, roll, midipath = None, rollpath = None):
+		# append a roll and all of its tapes
+		midipath = roll.midipath if midipath is None else midipath
+		labels = []
+		for label, tape in zip(roll.labels, roll_tapes(roll, rollpath)):
+			data = tape.to_bytes()
+			entry = dict([(field, to_json(getattr(label, field))) for field in LABEL_FIELDS])
+			entry['offset'] = self.file.tell()
+			entry['size'] = len(data)
+			self.file.write(data) # tapes are padded to 8 bytes, so offsets stay aligned
+			labels.append(entry)
+
+		self.rolls.append({
+			'midipath': archive_key(midipath),
+			'md5': getattr(roll, 'md5', None),
+			'labels': labels,
+			})
+
+	def close(self):
+		index = json.dumps({'rolls': self.rolls}).encode('utf-8')
+		offset = self.file.tell()
+		self.file.write(index)
+		self.file.seek(0)
+		self.file.write(ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, offset, len(index)))
+		self.file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+class RollArchive:
+	# read side - one mapping of the whole archive; tapes are views into it
+	def __init__(self, filename, mmap = True):
+		self.filename = filename
+		if mmap:
+			self.buffer = np.memmap(filename, dtype = np.uint8, mode = 'r')
+		else:
+			with open(filename, 'rb') as f:
+				self.buffer = f.read()
+
+		(magic, version, offset, size) = ARCHIVE_HEADER.unpack_from(self.buffer, 0)
+		if magic != ARCHIVE_MAGIC or version != ARCHIVE_VERSION:
+			raise ValueError("Unsupported archive: {0} version {1}".format(magic, version))
+
+		self.rolls = json.loads(bytes(self.buffer[offset:offset + size]).decode('utf-8'))['rolls']
+		self.index = dict([(entry['midipath'], entry) for entry in self.rolls])
+
+	def __len__(self):
+		return len(self.rolls)
+
+	def __contains__(self, midipath):
+		return archive_key(midipath) in self.index
+
+	def __iter__(self):
+		# rolls in file order - the tapes are laid out sequentially
+		for entry in self.rolls:
+			yield self.__roll(entry)
+
+	def paths(self):
+		return [entry['midipath'] for entry in self.rolls]
+
+	def tape(self, midipath, index):
+		entry = self.index[archive_key(midipath)]['labels'][index]
+		return MusicTape.from_buffer(self.buffer, entry['offset'])
+
+	def roll(self, midipath):
+		return self.__roll(self.index[archive_key(midipath)])
+
+	def __roll(self, entry):
+		labels = [TapeLabel(*[label[field] for field in LABEL_FIELDS]) for label in entry['labels']]
+		tapes = [MusicTape.from_buffer(self.buffer, label['offset']) for label in entry['labels']]
+		roll = MusicRoll(entry['midipath'], labels = labels, tapes = tapes)
+		roll.self_contained = True
+		if entry['md5'] is not None:
+			roll.set_hash(entry['md5'])
+		return roll
+
+def to_json(value):
+	# labels carry numpy scalars from normalization
+	return value.item() if isinstance(value, np.generic) else value
+
+def pack_corpus(folder, filename):
+	# pack every roll under a folder, keyed by midi path relative to the folder
+	rollpaths = []
+	for root, dirs, files in os.walk(folder):
+		for file in files:
+			if file.endswith(".mrl"):
+				rollpaths.append(os.path.join(root, file))
+
+	with RollArchiveWriter(filename) as archive:
+		for rollpath in sorted(rollpaths):
+			print("Packing '{0}'".format(rollpath))
+			roll = pickle.load(open(rollpath, 'rb'))
+			archive.add(roll, os.path.relpath(rollpath, folder)[:-4] + '.mid', rollpath)
+	return len(rollpaths)
+
+if __name__ == "__main__":
+	# python rollarchive.py <folder> <archive.mra>
+	folder = sys.argv[1] if len(sys.argv) > 1 else '.'
+	filename = sys.argv[2] if len(sys.argv) > 2 else 'corpus.mra'
+	print("Packed {0} rolls into '{1}'".format(pack_corpus(folder, filename), filename))
@@ -0,0 +1,142 @@
+# Training batches over a folder of music rolls
+# Pieces are read and densified (combine_notes) by background workers, and sent back once each;
+# windows are views into them, mixed in a shuffling buffer and copied only into (batch, window, 128, 2) arrays.
+
+import os
+import sys
+import time
+import pickle
+import multiprocessing
+import numpy as np
+from collections import deque
+from MusicRoll import MusicRoll
+
+WIDTH = 128 # notes per slice in a batch (combine_notes gives 127)
+
+def roll_paths(folder):
+	paths = []
+	for root, dirs, files in os.walk(folder):
+		for file in files:
+			if file.endswith(".mrl"):
+				paths.append(os.path.join(root, file))
+	return sorted(paths)
+
+def piece_notes(job):
+	# dense (length, WIDTH, 2) notes of every tempo group of one roll at least a window long
+	(rollpath, window, dtype) = job
+	roll = pickle.load(open(rollpath, 'rb'))
+
+	pieces = []
+	for tempo, group in roll.get_tape_groups(rollpath = rollpath).items():
+		notes = MusicRoll.combine_notes(group, dtype)
+		if len(notes) < window:
+			continue
+		padded = np.zeros((len(notes), WIDTH, 2), dtype = dtype)
+		padded[:, :notes.shape[1]] = notes
+		pieces.append(padded)
+	return pieces
+
+def piece_windows(notes, window, stride):
+	# every window of a piece, as views into it
+	return [notes[start:start + window] for start in np.r_[0:len(notes) - window + 1:stride]]
+
+def transposed(window, shift):
+	# move every note up by shift semitones (down if negative); notes moved off either end are lost
+	if shift == 0:
+		return window
+	output = np.zeros_like(window)
+	if shift > 0:
+		output[:, shift:] = window[:, :-shift]
+	else:
+		output[:, :shift] = window[:, -shift:]
+	return output
+
+class RollDataset:
+	# iterate to get one pass (epoch) of batches over the rolls
+	#	window: time slices per example; stride: slices between window starts (window if None)
+	#	shuffle: windows held in the shuffling buffer (0 or 1 keeps file order)
+	#	transpose: largest random transposition, in semitones either way
+	#	workers: processes densifying pieces (0 to do it in this process); prefetch: pieces read ahead
+	def __init__(self, paths, window = 64, stride = None, batch = 32, shuffle = 4096, transpose = 0,
+			workers = 2, prefetch = 4, dtype = np.float32, drop_last = True, seed = None):
+		self.paths = roll_paths(paths) if isinstance(paths, str) else list(paths)
+		self.window = window
+		self.stride = window if stride is None else stride
+		self.batch = batch
+		self.shuffle = shuffle
+		self.transpose = transpose
+		self.workers = workers
+		self.prefetch = prefetch
+		self.dtype = dtype
+		self.drop_last = drop_last
+		self.random = np.random.default_rng(seed)
+
+	def pieces(self):
+		# dense tempo groups of each roll, read by the workers no more than prefetch rolls ahead
+		paths = list(self.paths)
+		if self.shuffle > 1:
+			self.random.shuffle(paths)
+		jobs = iter([(path, self.window, self.dtype) for path in paths])
+
+		if self.workers == 0:
+			for job in jobs:
+				yield piece_notes(job)
+			return
+
+		pool = multiprocessing.Pool(self.workers)
+		try:
+			pending = deque()
+			for job in jobs:
+				pending.append(pool.apply_async(piece_notes, (job,)))
+				if len(pending) >= self.prefetch:
+					break
+			while pending:
+				pieces = pending.popleft().get()
+				job = next(jobs, None)
+				if job is not None:
+					pending.append(pool.apply_async(piece_notes, (job,)))
+				yield pieces
+		finally:
+			pool.terminate()
+			pool.join()
+
+	def windows(self):
+		# single windows (views into their pieces), through the shuffling buffer
+		buffer = []
+		for pieces in self.pieces():
+			for notes in pieces:
+				for window in piece_windows(notes, self.window, self.stride):
+					buffer.append(window)
+					if len(buffer) >= max(self.shuffle, 1):
+						yield self.__take(buffer)
+		while buffer:
+			yield self.__take(buffer)
+
+	def __take(self, buffer):
+		# random window out of the buffer (the oldest, when not shuffling)
+		i = self.random.integers(len(buffer)) if self.shuffle > 1 else 0
+		buffer[i], buffer[-1] = buffer[-1], buffer[i]
+		window = buffer.pop()
+		if self.transpose:
+			window = transposed(window, int(self.random.integers(-self.transpose, self.transpose + 1)))
+		return window
+
+	def __iter__(self):
+		batch = []
+		for window in self.windows():
+			batch.append(window)
+			if len(batch) == self.batch:
+				yield np.stack(batch)
+				batch = []
+		if batch and not self.drop_last:
+			yield np.stack(batch)
+
+if __name__ == "__main__":
+	# python rolldataset.py <folder> - one pass, reporting throughput
+	dataset = RollDataset(sys.argv[1] if len(sys.argv) > 1 else '.', transpose = 6)
+	start = time.time()
+	batches = 0
+	for batch in dataset:
+		batches += 1
+	elapsed = time.time() - start
+	print("{0} batches of {1} from {2} rolls in {3:.2f}s".format(batches, (dataset.batch, dataset.window, WIDTH, 2), len(dataset.paths), elapsed))
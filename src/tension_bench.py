@@ -0,0 +1,37 @@
+# Microbenchmark for TensionModule.mut_tens
+# lookup table against the masked assignment it replaced, for note sets of 2 to 88 notes
+
+import timeit
+import numpy as np
+import TensionModule
+
+def masked_tens(metric, intvs):
+	# mut_tens before the lookup table: 12 boolean-mask passes, then a power
+	tens = np.tile(intvs, (1,1))
+	for i in np.r_[:12]:
+		tens[intvs == (12 - i) % 12] = metric[i]
+	return 3 ** tens
+
+def best_time(function, repeat = 5):
+	# seconds per call, best of a few runs of ~0.1s each
+	number, elapsed = timeit.Timer(function).autorange()
+	number = max(number // 2, 1)
+	return min(timeit.repeat(function, number = number, repeat = repeat)) / number
+
+if __name__ == '__main__':
+	keys = np.r_[:88]
+	for name in ['dissonance', 'western']:
+		metric = getattr(TensionModule.metric, name)
+		tensmod = TensionModule.TensionModule(metric)
+
+		print("Metric:", name)
+		print("\t{0:>5} {1:>12} {2:>12} {3:>8}".format('notes', 'masked (us)', 'lookup (us)', 'speedup'))
+		for size in [2, 3, 4, 6, 8, 12, 16, 24, 32, 48, 64, 88]:
+			quanta = np.sort(np.random.RandomState(size).choice(keys, size, replace = False))
+			intvs = (np.tile(quanta, (size, 1)) + 12 - np.tile(quanta, (size, 1)).T) % 12
+
+			assert np.array_equal(masked_tens(metric, intvs), tensmod.mut_tens(intvs))
+
+			masked = best_time(lambda: masked_tens(metric, intvs))
+			lookup = best_time(lambda: tensmod.mut_tens(intvs))
+			print("\t{0:>5} {1:>12.2f} {2:>12.2f} {3:>7.1f}x".format(size, masked * 1e6, lookup * 1e6, masked / lookup))